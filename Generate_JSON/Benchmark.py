@@ -0,0 +1,209 @@
+import sys
+import os
+import csv
+import time
+import random
+import string
+import platform
+import datetime
+import subprocess
+import xlwt # Dependency for the benchmark only (can be installed through pip)
+import openpyxl # Dependency for the benchmark only (can be installed through pip)
+
+import GenerateJSON # Also adds the library folder to the path
+json = GenerateJSON.json
+import delimited_workbook
+
+class WorkbookGenerator(): # Creates synthetic spreadsheets laid out as described by a configuration file
+    def __init__(self,configuration,number_of_rows,missing_fraction,text_width,seed):
+        self.configuration = configuration
+        self.number_of_rows = number_of_rows
+        self.missing_fraction = missing_fraction
+        self.text_width = text_width
+        self.random = random.Random(seed)
+
+        self.calculateColumnNumbers()
+
+    def calculateColumnNumbers(self): # Places each property in its configured column, and unknown (?) columns after the last known one
+        self.column_numbers = []
+        next_free_column = max([GenerateJSON.Dataset.charactersToOrd(each_property["column"]) for each_property in self.configuration["properties"] if each_property["column"]!="?"]+[-1])+1
+        for each_property in self.configuration["properties"]:
+            if each_property["column"]=="?":
+                self.column_numbers.append(next_free_column)
+                next_free_column += 1
+            else:
+                self.column_numbers.append(GenerateJSON.Dataset.charactersToOrd(each_property["column"]))
+
+    def createRows(self): # Returns the header rows and data rows as lists of values (None for empty cells)
+        width = max(self.column_numbers)+1
+        rows = []
+        for header_row in range(self.configuration["header_rows"]-1):
+            rows.append(["Synthetic header row "+str(header_row+1)]+[None]*(width-1))
+        rows.append([None]*width)
+        for each_property,column_number in zip(self.configuration["properties"],self.column_numbers):
+            rows[-1][column_number] = each_property["name"]
+        for row in range(self.number_of_rows):
+            rows.append([None]*width)
+            for each_property,column_number in zip(self.configuration["properties"],self.column_numbers):
+                rows[-1][column_number] = self.createValue(each_property)
+        return rows
+    def createValue(self,each_property): # Returns a random value of the right type for a property (or the missing value)
+        required = "required" in each_property.keys() and each_property["required"]
+        if not required and self.random.random()<self.missing_fraction:
+            return self.configuration["missing_value"]
+
+        property_type = each_property["type"] if "type" in each_property.keys() else "text"
+        if property_type=="numeric":
+            limits = [None,None]
+            for limit_name in ("hard_limits","soft_limits"):
+                if limit_name in each_property.keys() and each_property[limit_name]:
+                    limits = [limit if limit is not None else existing for limit,existing in zip(each_property[limit_name],limits)]
+            minimum = limits[0] if limits[0] is not None else 0
+            maximum = limits[1] if limits[1] is not None else minimum+1000
+            return self.random.uniform(minimum,maximum)
+        elif property_type=="DOI":
+            return "10."+str(self.random.randint(1000,9999))+"/synthetic."+self.createText(8).replace(" ","")
+        elif property_type=="Boolean":
+            return self.random.choice(["TRUE","FALSE"])
+        elif "acceptable_values" in each_property.keys() and each_property["acceptable_values"]:
+            return self.random.choice(each_property["acceptable_values"])
+        return self.createText(self.text_width)
+    def createText(self,width):
+        return "".join(self.random.choices(string.ascii_lowercase+" ",k=width))
+
+    def createWorkbook(self,filepath): # Writes a workbook (.xls, .xlsx, .csv or .tsv depending on the file ending)
+        rows = self.createRows()
+        if delimited_workbook.isDelimited(filepath):
+            delimiter = delimited_workbook.delimiters[filepath.rsplit(".",1)[-1]]
+            with open(filepath,"w",newline="",encoding="utf-8") as file:
+                csv.writer(file,delimiter=delimiter).writerows([["" if value is None else value for value in row] for row in rows])
+        elif filepath.endswith("xlsx"):
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet("Data")
+            for row in rows:
+                sheet.append(row)
+            workbook.save(filepath)
+        else:
+            workbook = xlwt.Workbook()
+            sheet = workbook.add_sheet("Data")
+            for row_number,row in enumerate(rows):
+                for column_number,value in enumerate(row):
+                    if value is not None:
+                        sheet.write(row_number,column_number,value)
+            workbook.save(filepath)
+
+class Benchmark(): # Times GenerateJSON on synthetic spreadsheets, as described by a benchmark configuration file
+    def __init__(self):
+        self.checkCommandLineInput()
+        self.importConfiguration()
+        self.importPreviousResults()
+
+        self.results = {"label":self.configuration["label"] if "label" in self.configuration.keys() else None,
+                        "commit":self.getCommit(),
+                        "date":datetime.datetime.now().isoformat(timespec="seconds"),
+                        "python":platform.python_version(),
+                        "platform":platform.platform(),
+                        "cases":[]}
+        for case in self.configuration["cases"]:
+            self.results["cases"].append(self.runCase(case))
+            self.printCase(self.results["cases"][-1])
+
+        self.saveResults()
+
+    # inputs
+    def checkCommandLineInput(self): # Looks for the required input file (the JSON benchmark configuration file)
+        if len(sys.argv)!=2:
+            raise ValueError("There must be one input - the benchmark config file")
+        if not os.path.isfile(str(sys.argv[1])):
+            raise ValueError("Input file not found")
+    def importConfiguration(self): # Opens and imports the JSON benchmark configuration file
+        file = open(str(sys.argv[1]),"r")
+        self.configuration = json.load(file)
+        file.close()
+        if not self.configuration["output_folder"].endswith("/"):
+            self.configuration["output_folder"] += "/"
+    def importPreviousResults(self): # Opens the results of previous runs (if there are any) so they can be compared
+        if os.path.isfile(self.configuration["results_file"]):
+            with open(self.configuration["results_file"],"r",encoding="utf-8") as file:
+                self.previous_results = json.load(file)
+        else:
+            self.previous_results = []
+    @staticmethod
+    def getCommit(): # Returns the current git commit, if there is one
+        try:
+            return subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,text=True,check=True).stdout.strip()
+        except (OSError,subprocess.CalledProcessError):
+            return None
+
+    # running
+    def prepareCase(self,case): # Generates the spreadsheets for a case, and writes a configuration file which points GenerateJSON at them
+        configuration_file = case["configuration"] if "configuration" in case.keys() else self.configuration["configuration"]
+        with open(configuration_file,"r") as file:
+            configuration = json.load(file)
+
+        case_folder = self.configuration["output_folder"]+case["name"]+"/"
+        data_folder = case_folder+"Data/"
+        os.makedirs(data_folder,exist_ok=True)
+        for file in os.listdir(data_folder):
+            os.remove(data_folder+file)
+        seed = self.configuration["seed"] if "seed" in self.configuration.keys() else 0
+        for file_number in range(case["files"]):
+            generator = WorkbookGenerator(configuration,case["rows"],case["missing_fraction"],case["text_width"],seed="{}-{}-{}".format(seed,case["name"],file_number))
+            generator.createWorkbook(data_folder+"synthetic_"+str(file_number).zfill(4)+"."+case["file_ending"])
+
+        configuration["root_folder"] = data_folder
+        configuration["file_endings"] = [case["file_ending"]]
+        configuration["output_file"] = case_folder+"output.json"
+        configuration["metrics_file"] = case_folder+"metrics.json"
+        if "settings" in case.keys(): # Settings such as workers or stream_output, so modes can be compared
+            configuration.update(case["settings"])
+        benchmark_configuration_file = case_folder+"configuration.json"
+        with open(benchmark_configuration_file,"w") as file:
+            json.dump(configuration,file,indent=4)
+        return benchmark_configuration_file
+    def runCase(self,case): # Generates the data for a case, then times the whole script and each stage
+        configuration_file = self.prepareCase(case)
+        case_folder = os.path.dirname(configuration_file)+"/"
+        result = {"name":case["name"],"parameters":case}
+
+        # End to end, in a separate process so the peak memory is for this case alone
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable,"GenerateJSON.py",configuration_file],stdout=subprocess.DEVNULL)
+        pid,status,usage = os.wait4(process.pid,0) # Unlike wait, wait4 gives the resource usage of this process alone
+        process.returncode = status
+        result["seconds"] = time.perf_counter()-start
+        if status!=0:
+            raise RuntimeError("GenerateJSON failed for case "+case["name"])
+        result["peak_rss_kb"] = usage.ru_maxrss//1024 if sys.platform=="darwin" else usage.ru_maxrss # macOS reports bytes rather than kilobytes
+
+        # Each stage, from the metrics recorded by GenerateJSON
+        with open(case_folder+"metrics.json","r",encoding="utf-8") as file:
+            metrics = json.load(file)
+        result["stages"] = {stage:total["wall_seconds"] for stage,total in metrics["totals_by_stage"].items()}
+        result["files"] = len(metrics["totals_by_file"])
+        result["rows"] = sum(record["rows"] for record in metrics["records"] if record["stage"]=="parseToDatapoints")
+        result["rows_per_second"] = result["rows"]/result["seconds"]
+        result["files_per_second"] = result["files"]/result["seconds"]
+        return result
+
+    # outputs
+    def getPreviousCase(self,name): # Returns the most recent previous result for a case with the same name
+        for previous_run in reversed(self.previous_results):
+            for previous_case in previous_run["cases"]:
+                if previous_case["name"]==name:
+                    return previous_run,previous_case
+        return None,None
+    def printCase(self,result): # Prints the result of a case, and how it compares to the previous run
+        print("{}: {} files, {} rows in {:.3f}s ({:.0f} rows/s, {:.2f} files/s, peak RSS {} kB)".format(result["name"],result["files"],result["rows"],result["seconds"],result["rows_per_second"],result["files_per_second"],result["peak_rss_kb"]))
+        print("    "+", ".join("{} {:.3f}s".format(stage,seconds) for stage,seconds in result["stages"].items()))
+        previous_run,previous_case = self.getPreviousCase(result["name"])
+        if previous_case:
+            print("    compared with {} ({}): {:+.1f}% rows/s, {:+.1f}% peak RSS".format(previous_run["commit"] or previous_run["label"],previous_run["date"],
+                                                                                   100*(result["rows_per_second"]/previous_case["rows_per_second"]-1),
+                                                                                   100*(result["peak_rss_kb"]/previous_case["peak_rss_kb"]-1)))
+    def saveResults(self): # Appends the results of this run to the results file
+        with open(self.configuration["results_file"],"w",encoding="utf-8") as file:
+            json.dump(self.previous_results+[self.results],file,indent=4)
+
+if __name__=="__main__":
+    Benchmark()
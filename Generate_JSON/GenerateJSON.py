@@ -1,10 +1,22 @@
 import sys
 import os
 import math
-import xlrd # Dependency (can be installed through pip)
+import time
+import hashlib
+import pickle
+import re
+import functools
+import threading
+import queue
+import concurrent.futures
+import multiprocessing
+import numpy # Dependency (can be installed through pip)
 
 sys.path.append('./../Libraries') # Add the library folder to the path
 import json_alternate as json  # Needs local
+from delimited_workbook import openWorkbook # Needs local (opens .csv and .tsv files as well as workbooks)
+import memory_usage # Needs local
+import header_layout # Needs local
 
 class FlatEncoder(json.JSONEncoder): # Encodes an array of objects into a JSON array of objects
     def default(self,input):
@@ -12,104 +24,1152 @@ class FlatEncoder(json.JSONEncoder): # Encodes an array of objects into a JSON a
             datapoints_as_dictionaries = tuple(input.convertDatapointsToFlatDictionaries()) # Use a tuple to prevent additional brackets
             return datapoints_as_dictionaries
 
+class JSONWriter(): # Writes datasets to a file one at a time, producing the same flat JSON array as using the FlatEncoder on a list of datasets
+    def __init__(self,filepath):
+        self.filepath = filepath
+        self._encoder = FlatEncoder(indent=4,ensure_ascii=False)
+        self._newline_indent = "\n"+" "*4 # Each dataset starts on a new line at the first level of indentation
+        self._file = open(self.filepath+".tmp",'w',encoding='utf-8') # Written to a temporary file, which replaces the output when complete
+        self._file.write("[")
+        self._empty = True
+
+    def writeDataset(self,dataset): # Encodes a single dataset and writes it to the file
+        self.writeFragment(self.encodeDataset(dataset))
+    def writeFragment(self,fragment): # Writes an already encoded dataset to the file
+        if self._empty:
+            self._file.write(self._newline_indent)
+            self._empty = False
+        else:
+            self._file.write(","+self._newline_indent)
+        self._file.write(fragment)
+    def close(self): # Closes the array and the file
+        if self._empty:
+            self._file.write("]")
+        else:
+            self._file.write("\n]")
+        self._file.close()
+        os.replace(self.filepath+".tmp",self.filepath) # Readers see either the old or the new file, never a partial one
+
+    def encodeDataset(self,dataset): # Encodes a dataset as it would appear inside the full array (without the surrounding brackets)
+        return self.encodeDatapoints(dataset.convertDatapointsToFlatDictionaries())
+    def encodeDatapoints(self,datapoints_as_dictionaries): # Encodes a list of datapoint dictionaries in the same way as a dataset
+        encoded = "".join(self._encoder.iterencode([tuple(datapoints_as_dictionaries)])) # Use a tuple to prevent additional brackets
+        return encoded[len("["+self._newline_indent):-len("\n]")]
+
+class ColumnarWriter(): # Collects datasets into columns, then writes them to a compact binary file
+    # The file contains the ASCII bytes "PCO2COL1", a little-endian uint32 giving the length of a UTF-8 JSON header, padding to a multiple of 8 bytes, then the body
+    # The header lists each column with its name, type and the position (in bytes from the start of the body) of its data
+    # Numeric columns are little-endian float64 arrays (NaN where missing), text columns are little-endian int32 codes (-1 where missing) into a table of values stored as a UTF-8 JSON array
+    magic = b"PCO2COL1"
+
+    def __init__(self,filepath,schema):
+        self.filepath = filepath
+        self.schema = schema # A list of (name,type) pairs
+        self.number_of_rows = 0
+        self._chunks = {name:[] for name,column_type in self.schema}
+        self._tables = {name:{} for name,column_type in self.schema if column_type=="text"} # Maps each text value to its code
+
+    def addDataset(self,dataset): # Appends the output rows of a dataset to each column
+        rows = dataset.getOutputRows()
+        for name,column_type in self.schema:
+            if column_type=="numeric":
+                if name in dataset.data_by_column:
+                    self._chunks[name].append(dataset.getNumericColumn(name,rows))
+                else:
+                    self._chunks[name].append(numpy.full(len(rows),numpy.nan))
+            else:
+                if name in dataset.data_by_column:
+                    self._chunks[name].append(dataset.getOutputCodes(name,rows,self._tables[name]))
+                else:
+                    self._chunks[name].append(numpy.full(len(rows),-1,dtype="<i4"))
+        self.number_of_rows += len(rows)
+    def close(self): # Writes the header and columns to the file
+        header = {"version":1,"number_of_rows":self.number_of_rows,"columns":[]}
+        body = []
+        offset = 0
+        for name,column_type in self.schema:
+            if column_type=="numeric":
+                data = numpy.concatenate(self._chunks[name]+[numpy.empty(0)]).astype("<f8").tobytes()
+                header["columns"].append({"name":name,"type":"numeric","offset":offset,"length":len(data)})
+                body,offset = self.appendBlock(body,offset,data)
+            else:
+                codes = numpy.concatenate(self._chunks[name]+[numpy.empty(0,dtype="<i4")]).astype("<i4").tobytes()
+                table = json.dumps(list(self._tables[name].keys()),ensure_ascii=False,separators=(",",":")).encode("utf-8")
+                header["columns"].append({"name":name,"type":"text","offset":offset,"length":len(codes),"table_offset":offset+self.getPaddedLength(len(codes)),"table_length":len(table)})
+                body,offset = self.appendBlock(body,offset,codes)
+                body,offset = self.appendBlock(body,offset,table)
+
+        header_bytes = json.dumps(header,separators=(",",":")).encode("utf-8")
+        header_bytes += b" "*(self.getPaddedLength(len(self.magic)+4+len(header_bytes))-(len(self.magic)+4+len(header_bytes))) # Pad so that the body starts on a multiple of 8 bytes
+        with open(self.filepath+".tmp","wb") as file:
+            file.write(self.magic)
+            file.write(len(header_bytes).to_bytes(4,"little"))
+            file.write(header_bytes)
+            for block in body:
+                file.write(block)
+        os.replace(self.filepath+".tmp",self.filepath)
+
+    def appendBlock(self,body,offset,data): # Adds a block of data to the body, padded so that the next block starts on a multiple of 8 bytes (allowing typed array views)
+        padded_length = self.getPaddedLength(len(data))
+        body.append(data+b"\x00"*(padded_length-len(data)))
+        return body,offset+padded_length
+    @staticmethod
+    def getPaddedLength(length):
+        return -(-length//8)*8
+
+class DictionaryWriter(ColumnarWriter): # Collects datasets into columns like the ColumnarWriter, but writes them as JSON with low cardinality text columns dictionary encoded
+    maximum_table_fraction = 0.5 # Text columns are only encoded if they have at most this many distinct values per row
+
+    def __init__(self,filepath,schema):
+        super().__init__(filepath,schema)
+        self.integer_columns = set() # Numeric columns whose whole values are written without a decimal point
+        self._unconverted = {name:{} for name,column_type in self.schema if column_type=="numeric"} # Values of numeric columns which stayed as text in a dataset, by the row they start at
+
+    def addDataset(self,dataset):
+        first_row = self.number_of_rows
+        super().addDataset(dataset)
+        self.integer_columns |= dataset.integer_columns
+        for name in self._unconverted:
+            if name in dataset.data_by_column and dataset.data_by_column[name].dtype==object: # Written as they are in the JSON file, rather than with the text dropped
+                self._unconverted[name][first_row] = dataset.getColumnAsList(name,dataset.getOutputRows())
+    def close(self): # Writes each column as a list of values, or as a table of distinct values and a list of codes
+        columns = {}
+        for name,column_type in self.schema:
+            if column_type=="numeric":
+                values = numpy.concatenate(self._chunks[name]+[numpy.empty(0)]).tolist()
+                if name in self.integer_columns:
+                    columns[name] = [None if math.isnan(value) else int(value) if value.is_integer() else value for value in values]
+                else:
+                    columns[name] = [None if math.isnan(value) else value for value in values]
+                for first_row,unconverted_values in self._unconverted[name].items():
+                    columns[name][first_row:first_row+len(unconverted_values)] = unconverted_values
+            else:
+                codes = numpy.concatenate(self._chunks[name]+[numpy.empty(0,dtype="<i4")]).tolist()
+                table = list(self._tables[name].keys())
+                if len(table)<=self.maximum_table_fraction*len(codes):
+                    columns[name] = {"table":table,"codes":codes}
+                else:
+                    values = table+[None] # So that the code -1 gives None
+                    columns[name] = [values[code] for code in codes]
+
+        with open(self.filepath+".tmp","w",encoding="utf-8") as file:
+            json.dump({"version":1,"number_of_rows":self.number_of_rows,"columns":columns},file,ensure_ascii=False,separators=(",",":"))
+        os.replace(self.filepath+".tmp",self.filepath)
+
+class LevelOfDetailWriter(): # Writes decimated copies of the age and CO2 data of each proxy, one file for each tier (the number of points per proxy)
+    columns = ("age","co2","age_uncertainty_older","age_uncertainty_younger","co2_uncertainty_higher","co2_uncertainty_lower")
+
+    def __init__(self,output_file,tiers):
+        self.output_file = output_file
+        self.tiers = sorted(tiers)
+        self._chunks = {} # Arrays of values (one column for each of the columns above) for each proxy
+
+    def getTierFilepath(self,number_of_points): # Names each tier after the output file (e.g. Paleo-CO2_Archive_lod250.json)
+        root,extension = os.path.splitext(self.output_file)
+        return root+"_lod"+str(number_of_points)+extension
+
+    def addDataset(self,dataset): # Collects the age and CO2 columns of a dataset, grouped by proxy
+        if "age" not in dataset.data_by_column or "co2" not in dataset.data_by_column:
+            return
+        rows = dataset.getOutputRows()
+        values = dataset.getNumericColumns(self.columns,rows)
+        proxies = numpy.array(dataset.getOutputColumn("proxy",rows),dtype=object)
+        for proxy in set(proxies):
+            self._chunks.setdefault(proxy,[]).append(values[proxies==proxy])
+    def close(self): # Decimates the data of each proxy and writes one file per tier
+        data_by_proxy = {}
+        for proxy in sorted(self._chunks,key=str):
+            values = numpy.concatenate(self._chunks[proxy])
+            values = values[~numpy.isnan(values[:,0]) & ~numpy.isnan(values[:,1])] # Points without an age or CO2 can't be plotted
+            data_by_proxy[proxy] = values[numpy.argsort(values[:,0],kind="stable")]
+
+        for number_of_points in self.tiers:
+            records = []
+            for proxy,values in data_by_proxy.items():
+                for row in values[selectLevelOfDetailPoints(values,number_of_points)].tolist():
+                    record = {"proxy":proxy}
+                    for column,value in zip(self.columns,row):
+                        record[column] = None if math.isnan(value) else value
+                    records.append(record)
+            with open(self.getTierFilepath(number_of_points)+".tmp","w",encoding="utf-8") as file:
+                json.dump(records,file,ensure_ascii=False,separators=(",",":"))
+            os.replace(self.getTierFilepath(number_of_points)+".tmp",self.getTierFilepath(number_of_points))
+
+class SummaryWriter(): # Writes the ranges, counts and age coverage of the age and CO2 data (overall and for each proxy), so plots can be laid out before the data is loaded
+    columns = LevelOfDetailWriter.columns
+
+    def __init__(self,filepath,age_bins):
+        self.filepath = filepath
+        self.age_bins = age_bins # Either the number of equal width bins, or a list of bin edges
+        self._proxies = []
+        self._values = []
+
+    def addDataset(self,dataset): # Collects the proxy, age, CO2 and uncertainty columns of a dataset
+        rows = dataset.getOutputRows()
+        self._proxies += [str(proxy) for proxy in dataset.getOutputColumn("proxy",rows)]
+        self._values.append(dataset.getNumericColumns(self.columns,rows))
+    def close(self): # Summarises all the datapoints, then each proxy, and writes the summary
+        proxies = numpy.array(self._proxies,dtype=object)
+        values = numpy.concatenate(self._values+[numpy.empty((0,len(self.columns)))])
+        ages = values[:,0][~numpy.isnan(values[:,0])]
+        age_bin_edges = numpy.histogram_bin_edges(ages,bins=self.age_bins)
+
+        summary = {"version":1,"age_bin_edges":age_bin_edges.tolist(),"all":self.summarise(values,age_bin_edges),"proxies":{}}
+        for proxy in sorted(set(self._proxies)):
+            summary["proxies"][proxy] = self.summarise(values[proxies==proxy],age_bin_edges)
+
+        with open(self.filepath+".tmp","w",encoding="utf-8") as file:
+            json.dump(summary,file,indent=4,ensure_ascii=False)
+        os.replace(self.filepath+".tmp",self.filepath)
+
+    def summarise(self,values,age_bin_edges): # Returns the counts and ranges of each column, the ranges including uncertainties, and a histogram of ages
+        summary = {"number_of_datapoints":len(values),"columns":{}}
+        for column,column_values in zip(self.columns,values.T):
+            summary["columns"][column] = {"count":int(numpy.count_nonzero(~numpy.isnan(column_values))),"range":self.getRange(column_values)}
+        age,co2 = values[:,0],values[:,1]
+        uncertainties = numpy.nan_to_num(values[:,2:],nan=0.0) # Missing uncertainties count as zero
+        summary["age_range_with_uncertainty"] = self.getRange(numpy.concatenate([age-uncertainties[:,1],age+uncertainties[:,0]]))
+        summary["co2_range_with_uncertainty"] = self.getRange(numpy.concatenate([co2-uncertainties[:,3],co2+uncertainties[:,2]]))
+        summary["age_histogram"] = numpy.histogram(age[~numpy.isnan(age)],bins=age_bin_edges)[0].tolist()
+        return summary
+    @staticmethod
+    def getRange(values): # Returns the [minimum,maximum] of the values (ignoring NaN), or None if there aren't any
+        values = values[~numpy.isnan(values)]
+        if len(values)==0:
+            return None
+        return [float(values.min()),float(values.max())]
+
+class SpatialIndexWriter(): # Writes an index from each latitude/longitude grid cell to the ranges of rows of the output which lie inside it
+    def __init__(self,filepath,cell_size):
+        self.filepath = filepath
+        self.cell_size = cell_size # In degrees
+        self.number_of_latitude_cells = math.ceil(180/self.cell_size)
+        self.number_of_longitude_cells = math.ceil(360/self.cell_size)
+        self._cells = []
+
+    def addDataset(self,dataset): # Works out the grid cell of each output row (-1 where the location is missing or invalid)
+        rows = dataset.getOutputRows()
+        if len(rows)==0: # The output still has an empty [] element for this dataset, which takes up a row number but isn't in any cell
+            self._cells.append(numpy.full(1,-2))
+            return
+        latitudes,longitudes = dataset.getNumericColumns(("modern_latitude","modern_longitude"),rows).T
+        is_located = (numpy.abs(latitudes)<=90) & numpy.isfinite(longitudes) # Also false where the latitude is NaN
+        latitude_cells = numpy.minimum(((latitudes[is_located]+90)//self.cell_size).astype(int),self.number_of_latitude_cells-1) # The north pole goes in the northernmost cell
+        longitude_cells = (((longitudes[is_located]+180)%360)//self.cell_size).astype(int) # Longitudes are wrapped into [-180,180)
+        cells = numpy.full(len(rows),-1)
+        cells[is_located] = latitude_cells*self.number_of_longitude_cells+longitude_cells
+        self._cells.append(cells)
+    def close(self): # Groups the rows of each cell into ranges, and writes the index
+        cells = numpy.concatenate(self._cells+[numpy.empty(0,dtype=int)])
+        rows = numpy.argsort(cells,kind="stable") # The rows of each cell, in order
+        boundaries = numpy.flatnonzero(numpy.diff(cells[rows]))+1
+        index = {"version":1,"cell_size":self.cell_size,"number_of_rows":len(cells),"cells":[],"unlocated":[]}
+        for cell_rows in numpy.split(rows,boundaries) if len(rows) else []:
+            cell = int(cells[cell_rows[0]])
+            if cell==-2:
+                continue
+            elif cell==-1:
+                index["unlocated"] = self.getRanges(cell_rows)
+            else:
+                south = -90+(cell//self.number_of_longitude_cells)*self.cell_size
+                west = -180+(cell%self.number_of_longitude_cells)*self.cell_size
+                index["cells"].append({"latitude":[south,min(south+self.cell_size,90)],"longitude":[west,min(west+self.cell_size,180)],"number_of_rows":len(cell_rows),"rows":self.getRanges(cell_rows)})
+
+        with open(self.filepath+".tmp","w",encoding="utf-8") as file:
+            json.dump(index,file,ensure_ascii=False,separators=(",",":"))
+        os.replace(self.filepath+".tmp",self.filepath)
+
+    @staticmethod
+    def getRanges(rows): # Converts sorted row numbers into [start,end) ranges of consecutive rows
+        breaks = numpy.flatnonzero(numpy.diff(rows)!=1)+1
+        starts = numpy.concatenate([[rows[0]],rows[breaks]])
+        ends = numpy.concatenate([rows[breaks-1],[rows[-1]]])+1
+        return numpy.column_stack([starts,ends]).tolist()
+
+class ViewWriter(): # Writes the datapoints to another file in the same format as the output, leaving out those with any of the chosen flags set
+    unset_values = {"","FALSE","NO","N","F","0"} # Flags with these values (in any case), or without a value, are not set
+
+    def __init__(self,filepath,flag_columns):
+        self.flag_columns = flag_columns
+        self.writer = JSONWriter(filepath)
+
+    def addDataset(self,dataset): # Writes the output rows of a dataset which have none of the flags set
+        rows = dataset.getOutputRows()
+        is_kept = numpy.ones(len(rows),dtype=bool)
+        for column_name in self.flag_columns:
+            if column_name in dataset.data_by_column:
+                values = dataset.getColumnAsList(column_name,rows)
+                is_set_by_value = {value:self.isSet(value) for value in set(values)}
+                is_kept &= ~numpy.array([is_set_by_value[value] for value in values],dtype=bool)
+        if numpy.any(is_kept):
+            datapoints_as_dictionaries = dataset.convertDatapointsToFlatDictionaries()
+            self.writer.writeFragment(self.writer.encodeDatapoints([datapoints_as_dictionaries[index] for index in numpy.flatnonzero(is_kept)]))
+    def close(self):
+        self.writer.close()
+
+    def isSet(self,value): # Checks whether a flag is set (e.g. TRUE, YES or the DOI of a superseding dataset)
+        if value is None:
+            return False
+        return str(value).strip().upper() not in self.unset_values and value!=0
+
+class PartitionWriter(): # Writes the datapoints to one file for each proxy and age bucket, with a manifest describing each file
+    def __init__(self,folder,age_boundaries):
+        self.folder = folder
+        if not self.folder.endswith("/"):
+            self.folder += "/"
+        self.age_boundaries = sorted(age_boundaries) or [0] # The lower edge of each age bucket
+        os.makedirs(self.folder,exist_ok=True)
+        self._partitions = {}
+
+    def getAgeRange(self,bucket): # Returns the [minimum,maximum) ages of a bucket (None for the open end, or for datapoints without an age)
+        if bucket<0:
+            return None
+        if bucket==len(self.age_boundaries)-1:
+            return [self.age_boundaries[bucket],None]
+        return [self.age_boundaries[bucket],self.age_boundaries[bucket+1]]
+    def getPartition(self,proxy,bucket): # Returns the partition for a proxy and age bucket, creating its file if necessary
+        if (proxy,bucket) not in self._partitions:
+            age_range = self.getAgeRange(bucket)
+            if age_range is None:
+                age_label = "unknown_age"
+            elif age_range[1] is None:
+                age_label = "{:g}+".format(age_range[0])
+            else:
+                age_label = "{:g}-{:g}".format(*age_range)
+            filename = re.sub(r"[^\w\-+.]+","_",str(proxy))+"_"+age_label+".json"
+            if filename in [partition["file"] for partition in self._partitions.values()]: # Another proxy has the same name once cleaned up (e.g. B/Ca and B_Ca), so tell them apart with a hash of the proxy name
+                filename = filename[:-len(".json")]+"_"+hashlib.sha256(str(proxy).encode("utf-8")).hexdigest()[:8]+".json"
+            self._partitions[(proxy,bucket)] = {"file":filename,
+                                                "proxy":proxy,
+                                                "age_range":age_range,
+                                                "number_of_rows":0,
+                                                "age_bounds":None,
+                                                "co2_bounds":None,
+                                                "writer":JSONWriter(self.folder+filename)}
+        return self._partitions[(proxy,bucket)]
+
+    def addDataset(self,dataset): # Splits the output rows of a dataset between the partitions
+        rows = dataset.getOutputRows()
+        proxies = dataset.getOutputColumn("proxy",rows)
+        ages = dataset.getNumericColumn("age",rows) if "age" in dataset.data_by_column else numpy.full(len(rows),numpy.nan)
+        co2 = dataset.getNumericColumn("co2",rows) if "co2" in dataset.data_by_column else numpy.full(len(rows),numpy.nan)
+        buckets = numpy.clip(numpy.searchsorted(self.age_boundaries,ages,side="right")-1,0,len(self.age_boundaries)-1) # Ages below the first boundary go into the first bucket
+        buckets[numpy.isnan(ages)] = -1
+
+        groups = {}
+        for index,key in enumerate(zip(proxies,buckets.tolist())):
+            groups.setdefault(key,[]).append(index)
+        datapoints_as_dictionaries = dataset.convertDatapointsToFlatDictionaries()
+        for (proxy,bucket),indices in groups.items():
+            partition = self.getPartition(proxy,bucket)
+            partition["writer"].writeFragment(partition["writer"].encodeDatapoints([datapoints_as_dictionaries[index] for index in indices]))
+            partition["number_of_rows"] += len(indices)
+            partition["age_bounds"] = self.combineBounds(partition["age_bounds"],ages[indices])
+            partition["co2_bounds"] = self.combineBounds(partition["co2_bounds"],co2[indices])
+    def close(self): # Closes each partition file and writes the manifest
+        manifest = {"age_boundaries":self.age_boundaries,"partitions":[]}
+        for key in sorted(self._partitions,key=lambda key:(str(key[0]),key[1])):
+            partition = self._partitions[key]
+            partition.pop("writer").close()
+            manifest["partitions"].append(partition)
+        with open(self.folder+"manifest.json.tmp","w",encoding="utf-8") as file: # Written to a temporary file, so the manifest is never seen half-written
+            json.dump(manifest,file,indent=4,ensure_ascii=False)
+        os.replace(self.folder+"manifest.json.tmp",self.folder+"manifest.json")
+
+    @staticmethod
+    def combineBounds(bounds,values): # Extends [minimum,maximum] bounds to include the values (ignoring NaN)
+        values = values[~numpy.isnan(values)]
+        if len(values)==0:
+            return bounds
+        if bounds is None:
+            return [float(values.min()),float(values.max())]
+        return [min(bounds[0],float(values.min())),max(bounds[1],float(values.max()))]
+
+class ShardWriter(): # Writes each dataset to its own file named by the hash of its content, with a manifest listing the files in order
+    shard_pattern = re.compile(r"[0-9a-f]{64}\.json") # Only files named like a shard are ever removed, in case the folder holds other files
+    def __init__(self,folder):
+        self.folder = folder
+        if not self.folder.endswith("/"):
+            self.folder += "/"
+        os.makedirs(self.folder,exist_ok=True)
+        self.shards = []
+        self.importPreviousManifest()
+
+    def importPreviousManifest(self): # Opens the manifest from the previous run, so its shards can be kept until the next run
+        if os.path.isfile(self.folder+"manifest.json"):
+            with open(self.folder+"manifest.json","r",encoding="utf-8") as file:
+                self.previous_shards = json.load(file)["shards"]
+        else:
+            self.previous_shards = []
+
+    def addFragment(self,dataset,fragment): # Writes a dataset, already encoded for the JSON file, to a new shard unless a shard with the same content already exists
+        content = ("[\n    "+fragment+"\n]").encode("utf-8") # The same as the JSON file holding only this dataset
+        shard = hashlib.sha256(content).hexdigest()+".json"
+        if not os.path.isfile(self.folder+shard):
+            with open(self.folder+shard+".tmp","wb") as file:
+                file.write(content)
+            os.replace(self.folder+shard+".tmp",self.folder+shard)
+        self.shards.append({"file":dataset.filename,"shard":shard,"number_of_rows":len(dataset.getOutputRows()),"bytes":len(content)})
+    def close(self): # Writes the manifest, then removes shards which neither it nor the previous manifest use
+        manifest = {"version":1,"number_of_rows":sum(shard["number_of_rows"] for shard in self.shards),"shards":self.shards}
+        with open(self.folder+"manifest.json.tmp","w",encoding="utf-8") as file:
+            json.dump(manifest,file,indent=4,ensure_ascii=False)
+        os.replace(self.folder+"manifest.json.tmp",self.folder+"manifest.json")
+
+        used_shards = set(shard["shard"] for shard in self.shards+self.previous_shards) # Clients may still be reading the shards listed in the previous manifest
+        for file in os.listdir(self.folder):
+            if self.shard_pattern.fullmatch(file) and file not in used_shards:
+                os.remove(self.folder+file)
+
+class DeltaWriter(): # Compares the datapoints with those of the previous run, writing the added, removed and modified records as a patch from the previous version
+    def __init__(self,folder):
+        self.folder = folder
+        if not self.folder.endswith("/"):
+            self.folder += "/"
+        os.makedirs(self.folder,exist_ok=True)
+        self.records = {} # Each record, keyed by (file,row) where row is the row number in the spreadsheet
+        self.keys = [] # The key of each element of the output in order (None for the empty element written for a dataset without records)
+        self.importPreviousVersion()
+
+    def importPreviousVersion(self): # Opens the version chain and the records of the previous run (if there was one)
+        if os.path.isfile(self.folder+"versions.json") and os.path.isfile(self.folder+"records.pickle"):
+            with open(self.folder+"versions.json","r",encoding="utf-8") as file:
+                self.versions = json.load(file)
+            with open(self.folder+"records.pickle","rb") as file:
+                self.previous_records = pickle.load(file)
+        else:
+            self.versions = {"version":0,"deltas":[]}
+            self.previous_records = None
+        if os.path.isfile(self.folder+"keys.json"):
+            with open(self.folder+"keys.json","r",encoding="utf-8") as file:
+                self.previous_keys = json.load(file)["keys"]
+        else:
+            self.previous_keys = None
+
+    def addDataset(self,dataset): # Keys each output record by its file and row
+        first_row = dataset.configuration["header_rows"]+1 # Rows are numbered as in the spreadsheet
+        rows = dataset.getOutputRows().tolist()
+        if not rows: # The output still has an empty [] element for this dataset
+            self.keys.append(None)
+        for row,record in zip(rows,dataset.convertDatapointsToFlatDictionaries()):
+            self.records[(dataset.filename,first_row+row)] = record
+            self.keys.append((dataset.filename,first_row+row))
+    def close(self): # Writes a delta if anything has changed, then the keys, records and version chain for the new version
+        keys = [list(key) if key is not None else None for key in self.keys]
+        if self.previous_records is None:
+            self.versions["version"] = 1
+        else:
+            delta = self.getDelta()
+            if not (delta["added"] or delta["removed"] or delta["modified"]) and keys==self.previous_keys: # The keys also change when a spreadsheet without datapoints is added or removed
+                return
+            delta["from_version"] = self.versions["version"]
+            delta["to_version"] = self.versions["version"]+1
+            delta_file = "delta_"+str(delta["to_version"])+".json"
+            self.writeFile(delta_file,delta)
+            self.versions["version"] = delta["to_version"]
+            self.versions["deltas"].append({"from_version":delta["from_version"],"to_version":delta["to_version"],"file":delta_file,
+                                            "added":len(delta["added"]),"removed":len(delta["removed"]),"modified":len(delta["modified"])})
+
+        self.writeFile("keys.json",{"version":self.versions["version"],"keys":keys})
+        self.writeFile("versions.json",self.versions) # Written after the delta, so clients never see a version without its delta
+        with open(self.folder+"records.pickle.tmp","wb") as file:
+            pickle.dump(self.records,file,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.folder+"records.pickle.tmp",self.folder+"records.pickle")
+
+    def getDelta(self): # Lists the records which have been added, removed or modified since the previous run
+        delta = {"added":[],"removed":[],"modified":[]}
+        for (file,row),record in self.records.items():
+            if (file,row) not in self.previous_records:
+                delta["added"].append({"file":file,"row":row,"record":record})
+            elif self.previous_records[(file,row)]!=record:
+                delta["modified"].append({"file":file,"row":row,"record":record})
+        for file,row in self.previous_records:
+            if (file,row) not in self.records:
+                delta["removed"].append({"file":file,"row":row})
+        return delta
+    def writeFile(self,name,content): # Writes compact JSON to a file in the folder, replacing any previous version in one step
+        with open(self.folder+name+".tmp","w",encoding="utf-8") as file:
+            json.dump(content,file,ensure_ascii=False,separators=(",",":"))
+        os.replace(self.folder+name+".tmp",self.folder+name)
+
+class StageMetrics(): # Records the wall time, CPU time and number of rows (and optionally the memory allocated) of each stage for each file
+    def __init__(self,memory_profile=False):
+        self.records = []
+        if memory_profile:
+            self.allocation_tracker = memory_usage.AllocationTracker()
+        else:
+            self.allocation_tracker = None
+
+    def run(self,file,stage,function,*arguments,rows=None): # Runs a function, recording how long it took (rows can be a function, called afterwards)
+        if self.allocation_tracker:
+            self.allocation_tracker.start()
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.thread_time() # Only this thread, so configurations translated at the same time in a batch don't count each other's work
+        result = function(*arguments)
+        record = {"file":file,
+                  "stage":stage,
+                  "wall_seconds":time.perf_counter()-start_wall_time,
+                  "cpu_seconds":time.thread_time()-start_cpu_time,
+                  "rows":rows() if callable(rows) else rows}
+        if self.allocation_tracker:
+            record.update(self.allocation_tracker.stop())
+        self.records.append(record)
+        return result
+    def extend(self,metrics): # Adds the records of another set of metrics (e.g. from a dataset read in a worker process)
+        self.records += metrics.records
+
+    def getTotals(self,key): # Sums the wall and CPU time of the records, grouped by file or stage (records for the whole compilation have no file)
+        totals = {}
+        for record in self.records:
+            if record[key] is None:
+                continue
+            total = totals.setdefault(record[key],{"wall_seconds":0.0,"cpu_seconds":0.0})
+            total["wall_seconds"] += record["wall_seconds"]
+            total["cpu_seconds"] += record["cpu_seconds"]
+        return dict(sorted(totals.items(),key=lambda item:item[1]["wall_seconds"],reverse=True))
+    def save(self,filepath): # Writes the records, totals and memory use to a JSON file
+        with open(filepath+".tmp","w",encoding="utf-8") as file: # Written to a temporary file, which replaces the metrics when complete
+            json.dump({"peak_rss_mb":memory_usage.getPeakRSS(include_children=True),
+                       "allocation_sites_by_stage":memory_usage.combineAllocationSites(self.records),
+                       "totals_by_stage":self.getTotals("stage"),
+                       "totals_by_file":self.getTotals("file"),
+                       "records":self.records},file,indent=4,ensure_ascii=False)
+        os.replace(filepath+".tmp",filepath)
+    def printSummary(self,number_to_show=5): # Prints the slowest stages and files
+        print("Slowest stages:")
+        for stage,total in list(self.getTotals("stage").items())[:number_to_show]:
+            print("    {}: {:.3f}s wall, {:.3f}s CPU".format(stage,total["wall_seconds"],total["cpu_seconds"]))
+        print("Slowest files:")
+        for file,total in list(self.getTotals("file").items())[:number_to_show]:
+            print("    {}: {:.3f}s wall, {:.3f}s CPU".format(file,total["wall_seconds"],total["cpu_seconds"]))
+
+class FragmentCache(): # Keeps the encoded output of each file, so that files which haven't changed don't need to be read again
+    def __init__(self,folder,configuration_hash):
+        self.folder = folder
+        if not self.folder.endswith("/"):
+            self.folder += "/"
+        self.configuration_hash = configuration_hash
+
+        os.makedirs(self.folder,exist_ok=True)
+        self.importManifest()
+        self._files = {} # Entries for the manifest that will be saved
+
+    def importManifest(self): # Opens the manifest from the previous run (ignored if it was made with a different configuration)
+        self._previous_files = {}
+        if os.path.isfile(self.folder+"manifest.json"):
+            with open(self.folder+"manifest.json","r",encoding="utf-8") as file:
+                manifest = json.load(file)
+            if manifest["configuration_hash"]==self.configuration_hash:
+                self._previous_files = manifest["files"]
+        self._previous_fragments = {entry["content_hash"]:entry["number_of_datapoints"] for entry in self._previous_files.values()}
+    def getContentHash(self,file,filepath): # Hashes the content of a file (reusing the previous hash if the size and modification time are unchanged)
+        status = os.stat(filepath)
+        self._files[file] = {"size":status.st_size,"modified":status.st_mtime_ns}
+        if file in self._previous_files:
+            previous_entry = self._previous_files[file]
+            if previous_entry["size"]==status.st_size and previous_entry["modified"]==status.st_mtime_ns:
+                self._files[file]["content_hash"] = previous_entry["content_hash"]
+                return previous_entry["content_hash"]
+
+        content_hash = hashlib.sha256()
+        with open(filepath,"rb") as file_contents:
+            for block in iter(lambda:file_contents.read(1<<20),b""):
+                content_hash.update(block)
+        self._files[file]["content_hash"] = content_hash.hexdigest()
+        return self._files[file]["content_hash"]
+    def getFragmentPath(self,content_hash):
+        return self.folder+content_hash+".json"
+    def getColumnsPath(self,content_hash):
+        return self.folder+content_hash+".pickle"
+
+    def hasFragment(self,file,filepath): # Checks whether there is a cached fragment for the current content of the file
+        content_hash = self.getContentHash(file,filepath)
+        if content_hash in self._previous_fragments and os.path.isfile(self.getFragmentPath(content_hash)) and os.path.isfile(self.getColumnsPath(content_hash)):
+            self._files[file]["number_of_datapoints"] = self._previous_fragments[content_hash]
+            return True
+        return False
+    def readFragment(self,file): # Returns the cached fragment for a file
+        with open(self.getFragmentPath(self._files[file]["content_hash"]),"r",encoding="utf-8") as fragment_file:
+            return fragment_file.read()
+    def readColumns(self,file): # Returns the cached columns for a file (for outputs other than the JSON file)
+        with open(self.getColumnsPath(self._files[file]["content_hash"]),"rb") as columns_file:
+            return pickle.load(columns_file)
+    def storeFragment(self,file,fragment,dataset): # Saves the fragment and columns for a file that has just been read
+        fragment_path = self.getFragmentPath(self._files[file]["content_hash"])
+        columns_path = self.getColumnsPath(self._files[file]["content_hash"])
+        with open(fragment_path+".tmp","w",encoding="utf-8") as fragment_file: # Written to temporary files, so an interrupted run can't leave a partial fragment to be reused
+            fragment_file.write(fragment)
+        with open(columns_path+".tmp","wb") as columns_file:
+            pickle.dump(dataset.data_by_column,columns_file)
+        os.replace(fragment_path+".tmp",fragment_path)
+        os.replace(columns_path+".tmp",columns_path)
+        self._files[file]["number_of_datapoints"] = len(dataset)
+    def getNumberOfDatapoints(self,file):
+        return self._files[file]["number_of_datapoints"]
+
+    def save(self): # Writes the manifest for this run and removes fragments which are no longer used
+        with open(self.folder+"manifest.json.tmp","w",encoding="utf-8") as file:
+            json.dump({"configuration_hash":self.configuration_hash,"files":self._files},file,indent=4)
+        os.replace(self.folder+"manifest.json.tmp",self.folder+"manifest.json")
+        current_hashes = {entry["content_hash"] for entry in self._files.values()}
+        for content_hash in self._previous_fragments:
+            if content_hash not in current_hashes:
+                for path in (self.getFragmentPath(content_hash),self.getColumnsPath(content_hash)):
+                    if os.path.isfile(path):
+                        os.remove(path)
+
 class Compilation(): # Class to contain multiple datasets
-    def __init__(self):
-        self.checkCommandLineInput() # Ensure there is an input configuration file
+    def __init__(self,configuration_file=None,translate=True,batch=None):
+        self.configuration_file = configuration_file
+        self.batch = batch # The batch this is part of (if any), which shares maps and worker processes between configurations
+        if self.configuration_file is None:
+            self.checkCommandLineInput() # Ensure there is an input configuration file
+            self.configuration_file = str(sys.argv[1])
         self.importConfiguration() # Import the configuration file
         self.importColumnHeaderMap() # Import the column header map
         self.importProxyNameMap() # Import the proxy name map
 
         self.correctRootFolder() # Append a / to the root folder if necessary
 
-        self.doTranslation() # Performs the main function
+        if translate:
+            self.doTranslation() # Performs the main function
+            if self.shouldWatch():
+                self.watch()
     def checkCommandLineInput(self): # Looks for the required input file (the JSON configuration file)
         if len(sys.argv)!=2:
             raise ValueError("There must be one input - the config file")
         if not os.path.isfile(str(sys.argv[1])):
             raise ValueError("Input file not found")
     def importConfiguration(self): # Opens and imports the JSON configuration file
-        file = open(str(sys.argv[1]),"r")
+        file = open(self.configuration_file,"r")
         self.configuration = json.load(file)
         file.close()
     def importColumnHeaderMap(self): # Opens and imports the JSON column header map (if it exists)
         if "column_header_map" in self.configuration.keys() and self.configuration["column_header_map"]:
-            file = open(str(self.configuration["column_header_map"]),"r")
-            self.column_header_map = json.load(file)
-            file.close()
+            self.column_header_map = self.importMap(str(self.configuration["column_header_map"]))
         else:
             self.column_header_map = None # Set to None if there is no file
     def importProxyNameMap(self): # Opens and imports the JSON proxy name map (if it exists)
         if "proxy_name_map" in self.configuration.keys() and self.configuration["proxy_name_map"]:
-            file = open(str(self.configuration["proxy_name_map"]),"r")
-            self.proxy_name_map = json.load(file)
-            file.close()
+            self.proxy_name_map = self.importMap(str(self.configuration["proxy_name_map"]))
         else:
             self.proxy_name_map = None
+    def importMap(self,filepath): # Opens and imports a JSON map (or uses the copy already loaded by the batch, if this is part of one)
+        if self.batch is not None:
+            return self.batch.importMap(filepath)
+        file = open(filepath,"r")
+        json_map = json.load(file)
+        file.close()
+        return json_map
 
     def correctRootFolder(self): # Adds a trailing slash to root folder if required
         if not self.configuration["root_folder"].endswith("/"):
             self.configuration["root_folder"] += "/"
-    def shouldBeAnalysed(self,file): # Checks the file doesn't start with ~ to ignore Windows temporary files, or . to ignore hidden files
+    def checkFor(self,name): # Looks at whether the name is in the configuration file, and whether it is not None
+        if name in self.configuration.keys():
+            value = self.configuration[name]
+            if value is not None:
+                return True
+        return False
+    def shouldBeAnalysed(self,file): # Checks the file has one of the file endings (if given), and doesn't start with ~ to ignore Windows temporary files, or . to ignore hidden files
+        if self.checkFor("file_endings") and not file.endswith(tuple(self.configuration["file_endings"])):
+            return False
         if file[0]!="~" and file[0]!=".":
             return True
         else:
             return False
 
-    def doTranslation(self): # Main method to perform the translation
+    def getConfigurationHash(self): # Hashes the settings and maps that affect the content of the output, so that cached fragments are only used if they were made the same way
+        settings = {name:self.configuration[name] for name in ("header_rows","missing_value","properties") if name in self.configuration.keys()}
+        configuration_string = json.dumps([settings,self.column_header_map,self.proxy_name_map],sort_keys=True)
+        return hashlib.sha256(configuration_string.encode("utf-8")).hexdigest()
+
+    def getColumnSchema(self): # Returns the output name and type ("numeric" or "text") of each configured column
+        schema = []
+        for each_property in self.configuration["properties"]:
+            name = each_property["name"]
+            if self.column_header_map and name in self.column_header_map:
+                name = self.column_header_map[name]
+            if name not in [existing_name for existing_name,column_type in schema]:
+                if "type" in each_property.keys() and each_property["type"]=="numeric":
+                    schema.append((name,"numeric"))
+                else:
+                    schema.append((name,"text"))
+        return schema
+    def createOutputs(self): # Creates the outputs, other than the JSON file, requested in the configuration file (each is given every dataset in turn)
+        outputs = []
+        if self.checkFor("columnar_output_file"):
+            outputs.append(ColumnarWriter(self.configuration["columnar_output_file"],self.getColumnSchema()))
+        if self.checkFor("dictionary_output_file"):
+            outputs.append(DictionaryWriter(self.configuration["dictionary_output_file"],self.getColumnSchema()))
+        if self.checkFor("shard_folder"):
+            outputs.append(ShardWriter(self.configuration["shard_folder"]))
+        if self.checkFor("delta_folder"):
+            outputs.append(DeltaWriter(self.configuration["delta_folder"]))
+        if self.checkFor("partition_folder"):
+            if self.checkFor("partition_age_boundaries"):
+                outputs.append(PartitionWriter(self.configuration["partition_folder"],self.configuration["partition_age_boundaries"]))
+            else:
+                outputs.append(PartitionWriter(self.configuration["partition_folder"],[]))
+        if self.checkFor("views"):
+            for view in self.configuration["views"]:
+                outputs.append(ViewWriter(view["output_file"],view["exclude_flagged"]))
+        if self.checkFor("spatial_index_file"):
+            if self.checkFor("spatial_index_cell_size"):
+                outputs.append(SpatialIndexWriter(self.configuration["spatial_index_file"],self.configuration["spatial_index_cell_size"]))
+            else:
+                outputs.append(SpatialIndexWriter(self.configuration["spatial_index_file"],5))
+        if self.checkFor("summary_file"):
+            if self.checkFor("summary_age_bins"):
+                outputs.append(SummaryWriter(self.configuration["summary_file"],self.configuration["summary_age_bins"]))
+            else:
+                outputs.append(SummaryWriter(self.configuration["summary_file"],20))
+        if self.checkFor("level_of_detail_tiers") and self.configuration["level_of_detail_tiers"]:
+            outputs.append(LevelOfDetailWriter(self.configuration["output_file"],self.configuration["level_of_detail_tiers"]))
+        return outputs
+    def getOutputPaths(self): # Returns the absolute path of every file and folder written by the translation, so a batch can tell which configurations would write to the same place
+        paths = [self.configuration["output_file"]]
+        for name in ("metrics_file","cache_folder","columnar_output_file","dictionary_output_file","shard_folder","delta_folder","partition_folder","spatial_index_file","summary_file"):
+            if self.checkFor(name):
+                paths.append(self.configuration[name])
+        if self.checkFor("views"):
+            paths += [view["output_file"] for view in self.configuration["views"]]
+        return set(os.path.abspath(path) for path in paths) # Level of detail tiers are named after the output file, so are covered by it
+
+    def runStage(self,file,stage,function,*arguments,rows=None): # Runs a function, recording its timing if metrics are being collected
+        if self.metrics is None:
+            return function(*arguments)
+        return self.metrics.run(file,stage,function,*arguments,rows=rows)
+
+    def listFiles(self): # Returns the files to be analysed in alphabetical order, so the output doesn't depend on the order of the directory listing
+        return [file for file in sorted(os.listdir(self.configuration["root_folder"])) if self.shouldBeAnalysed(file)]
+    def createDataset(self,file,workbook=None,column_numbers=None,file_contents=None): # Creates a dataset with the necessary information for processing (and the workbook, column numbers or file contents, if they are already known)
+        return Dataset(filename=file,configuration=self.configuration,column_header_map=self.column_header_map,proxy_name_map=self.proxy_name_map,workbook=workbook,column_numbers=column_numbers,file_contents=file_contents)
+    def getNumberOfWorkers(self): # Returns the number of processes to use for reading files (1 unless specified in the configuration file)
+        if self.checkFor("workers"):
+            if self.configuration["workers"]==0:
+                return os.cpu_count()
+            return self.configuration["workers"]
+        return 1
+    def getNumberOfPrefetchedFiles(self): # Returns how many files to read ahead of the one being converted (0 unless specified in the configuration file)
+        if self.checkFor("prefetch_files"):
+            return self.configuration["prefetch_files"]
+        return 0
+
+    def ingestDatasets(self,files): # Yields each dataset, with its datapoints added, in the order of the files
+        number_of_workers = self.getNumberOfWorkers()
+        if number_of_workers>1:
+            yield from self.ingestDatasetsInParallel(files,number_of_workers)
+        elif self.getNumberOfPrefetchedFiles()>0:
+            yield from self.ingestDatasetsWithPrefetch(files,self.getNumberOfPrefetchedFiles())
+        else:
+            for file in files:
+                yield ingestDataset(self.createDataset(file))
+    def ingestDatasetsInParallel(self,files,number_of_workers): # Adds datapoints in a pool of processes, then yields the datasets in the order of the files
+        if self.batch is not None and self.batch.executor is not None: # Use the processes shared by the batch, rather than starting new ones
+            yield from self.submitDatasets(self.batch.executor,files,2*number_of_workers)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+                yield from self.submitDatasets(executor,files,2*number_of_workers)
+    def submitDatasets(self,executor,files,window): # Submits the next few files to the executor, then yields the datasets in the order of the files (at most window datasets are held at once)
+        futures = {}
+        for position,file in enumerate(files):
+            upcoming_files = [upcoming_file for upcoming_file in files[position:position+window] if upcoming_file not in futures]
+            for upcoming_file in sorted(upcoming_files,key=lambda upcoming_file:os.path.getsize(self.configuration["root_folder"]+upcoming_file),reverse=True): # Start the largest files first so one big file doesn't leave the other processes idle
+                futures[upcoming_file] = executor.submit(ingestDataset,self.createDataset(upcoming_file))
+            yield futures.pop(file).result() # Wait for each file in turn so the output is the same as when done one after another
+    def ingestDatasetsWithPrefetch(self,files,number_of_files): # Reads the next files into memory in a background thread, while the current file is converted
+        file_contents = queue.Queue(maxsize=number_of_files) # Limits how many files are held in memory at once
+        stop = threading.Event()
+        def readFiles(): # Reads each file in turn, waiting whenever the queue is full
+            for file in files:
+                try:
+                    with open(self.configuration["root_folder"]+file,"rb") as input_file:
+                        contents = input_file.read()
+                except Exception as error: # e.g. an OSError, or a MemoryError for a very large file
+                    contents = error # Raised when the file is reached, as it would have been without prefetching (and so the consumer isn't left waiting)
+                while not stop.is_set():
+                    try:
+                        file_contents.put(contents,timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        reader = threading.Thread(target=readFiles,daemon=True)
+        reader.start()
+        try:
+            for file in files:
+                contents = file_contents.get()
+                if isinstance(contents,Exception):
+                    raise contents
+                yield ingestDataset(self.createDataset(file,file_contents=contents))
+        finally: # Also stops the thread if the datasets aren't all used (e.g. after an error)
+            stop.set()
+            reader.join()
+
+    def shouldStreamOutput(self): # Checks whether datasets should be written as soon as they are parsed (rather than all at the end)
+        return self.checkFor("stream_output") and self.configuration["stream_output"]
+    def shouldProfileMemory(self): # Checks whether the memory allocated by each stage should be recorded (which slows the translation down)
+        return self.checkFor("memory_profile") and self.configuration["memory_profile"]
+    def shouldWatch(self): # Checks whether to keep running and rebuild the output whenever the files change
+        return self.checkFor("watch_interval")
+    def getFileSignatures(self,files): # Returns the size and modification time of each file, which change when the file does
+        signatures = {}
+        for file in files:
+            status = os.stat(self.configuration["root_folder"]+file)
+            signatures[file] = (status.st_size,status.st_mtime_ns)
+        return signatures
+
+    def watch(self): # Polls the root folder, rebuilding the output whenever files are added, changed or removed
+        print("Watching {} for changes (every {} seconds)".format(self.configuration["root_folder"],self.configuration["watch_interval"]))
+        try:
+            while True:
+                time.sleep(self.configuration["watch_interval"])
+                try:
+                    files = self.listFiles()
+                    signatures = self.getFileSignatures(files)
+                except OSError: # A file was removed while being listed, so try again next time
+                    continue
+                if signatures!=self.signatures:
+                    unchanged_datasets = {dataset.filename:dataset for dataset in self.datasets if self.signatures.get(dataset.filename)==signatures.get(dataset.filename)}
+                    previous_datasets,previous_signatures = self.datasets,self.signatures
+                    try:
+                        self.doTranslation(unchanged_datasets)
+                    except Exception as error: # e.g. a spreadsheet which is still being saved, so keep the previous output and try again next time
+                        print("Could not rebuild the output: {}".format(error))
+                        self.datasets,self.signatures = previous_datasets,previous_signatures
+        except KeyboardInterrupt:
+            print("Stopped watching")
+
+    def writeDataset(self,writer,file,dataset): # Encodes a dataset and writes it to the output (and to the cache, if there is one), returning the encoded fragment
+        fragment = self.runStage(file,"encode",writer.encodeDataset,dataset,rows=len(dataset))
+        writer.writeFragment(fragment)
+        if self.cache:
+            self.cache.storeFragment(file,fragment,dataset)
+        return fragment
+    def mergeMetrics(self,dataset): # Adds the stages recorded while reading a dataset to the metrics (once only, so datasets kept for watching aren't counted again)
+        if self.metrics and dataset.metrics is not None:
+            self.metrics.extend(dataset.metrics)
+        dataset.metrics = None
+    def reuseCachedFragment(self,writer,file): # Writes the output of a file saved by a previous run, returning the fragment
+        fragment = self.runStage(file,"reuseCachedFragment",self.cache.readFragment,file,rows=self.cache.getNumberOfDatapoints(file))
+        writer.writeFragment(fragment)
+        return fragment
+
+    def doTranslation(self,unchanged_datasets=None,files=None): # Main method to perform the translation (files with a dataset in unchanged_datasets aren't read again, and only the given files are used if specified)
+        if unchanged_datasets is None:
+            unchanged_datasets = {}
         self.datasets = [] # Create and empty list to hold datasets
-        for file in os.listdir(self.configuration["root_folder"]): # For each file in the data directory
-            if self.shouldBeAnalysed(file):
-                self.datasets.append(Dataset(filename=file,configuration=self.configuration,column_header_map=self.column_header_map,proxy_name_map=self.proxy_name_map)) # Append a dataset with the necessary information for processing
+        if files is None:
+            files = self.listFiles()
+        self.signatures = self.getFileSignatures(files)
+        if self.checkFor("cache_folder"):
+            self.cache = FragmentCache(self.configuration["cache_folder"],self.getConfigurationHash())
+            files_to_read = [file for file in files if not self.cache.hasFragment(file,self.configuration["root_folder"]+file)]
+        else:
+            self.cache = None
+            files_to_read = files
+        if self.shouldStreamOutput() or self.cache or self.checkFor("shard_folder"): # Shards are built from the fragments written to the output, so each dataset is only encoded once
+            writer = JSONWriter(self.configuration["output_file"])
+        else:
+            writer = None
+        self.outputs = self.createOutputs()
+        if self.checkFor("metrics_file") or self.shouldProfileMemory():
+            self.metrics = StageMetrics(memory_profile=self.shouldProfileMemory())
+        else:
+            self.metrics = None
 
-                # Run methods for data collection
-                self.datasets[-1].addDatapoints()
+        datasets = self.ingestDatasets([file for file in files_to_read if file not in unchanged_datasets])
+        files_to_read = set(files_to_read)
+        for file in files: # For each file in the data directory
+            if file in unchanged_datasets: # Already in memory, so neither read again nor loaded from the cache
+                dataset = unchanged_datasets[file]
+                self.mergeMetrics(dataset) # e.g. datasets read by the combined pipeline, which haven't been counted yet
+                if writer and file in files_to_read:
+                    fragment = self.writeDataset(writer,file,dataset)
+                elif writer:
+                    fragment = self.reuseCachedFragment(writer,file)
+            elif file in files_to_read:
+                dataset = next(datasets)
+                print("Added {} datapoints from {}".format(len(dataset),dataset.filename))
+                self.mergeMetrics(dataset)
+                if writer:
+                    fragment = self.writeDataset(writer,file,dataset)
+            else:
+                fragment = self.reuseCachedFragment(writer,file) # The file hasn't changed, so reuse the previous output
+                print("Reused {} datapoints from {}".format(self.cache.getNumberOfDatapoints(file),file))
+                dataset = None
+                if self.outputs or self.shouldWatch(): # Other outputs need the data, which can also be taken from the cache
+                    dataset = self.createDataset(file)
+                    self.runStage(file,"readCachedColumns",lambda:dataset.addCachedDatapoints(self.cache.readColumns(file)),rows=self.cache.getNumberOfDatapoints(file))
+            if dataset is not None and (writer is None or self.shouldWatch()): # Only kept if the output is written at the end, or for watching
+                self.datasets.append(dataset)
+            if dataset is not None:
+                for output in self.outputs:
+                    if hasattr(output,"addFragment"): # Given the fragment written to the output, rather than encoding the dataset again
+                        self.runStage(file,type(output).__name__,output.addFragment,dataset,fragment,rows=len(dataset))
+                    else:
+                        self.runStage(file,type(output).__name__,output.addDataset,dataset,rows=len(dataset))
 
-                print("Added {} datapoints from {}".format(len(self.datasets[-1].datapoints),file))
-                self.datasets[-1]._excel_workbook.release_resources()
+        for output in self.outputs:
+            self.runStage(None,type(output).__name__+".close",output.close)
+        if writer:
+            writer.close()
+        else:
+            with open(self.configuration["output_file"]+".tmp",'w',encoding='utf-8') as file: # Written to a temporary file, which replaces the output when complete
+                self.runStage(None,"json.dump",lambda:json.dump(self.datasets,file,cls=FlatEncoder,indent=4,ensure_ascii=False))
+            os.replace(self.configuration["output_file"]+".tmp",self.configuration["output_file"])
+        if self.cache:
+            self.cache.save()
+        if self.metrics:
+            if self.checkFor("metrics_file"):
+                self.metrics.save(self.configuration["metrics_file"])
+            self.metrics.printSummary()
+            if self.shouldProfileMemory():
+                memory_usage.printMemorySummary(self.metrics.records,include_children=True)
+        if self.checkFor("memory_budget_mb"): # Checked last, so the metrics are saved even if the budget is exceeded
+            memory_usage.checkMemoryBudget(self.configuration["memory_budget_mb"],include_children=True) # Includes worker processes
+class Batch(): # Translates several configuration files in one process, sharing the maps and worker processes between them, and running those which write to different places at the same time
+    def __init__(self,configuration_files=None):
+        if configuration_files is None:
+            self.checkCommandLineInput() # Ensure the input configuration files exist
+            configuration_files = [str(argument) for argument in sys.argv[1:]]
+        self.maps = {} # JSON maps loaded so far, keyed by their absolute path
+        self.executor = None # Pool of worker processes shared by every configuration (if any uses more than one worker)
 
-        with open(self.configuration["output_file"],'w',encoding='utf-8') as file:
-            json.dump(self.datasets,file,cls=FlatEncoder,indent=4,ensure_ascii=False)
-class Dataset(): # Class to contain multiple datapoints
-    def __init__(self,filename,configuration,column_header_map=None,proxy_name_map=None):
+        self.compilations = [Compilation(configuration_file,translate=False,batch=self) for configuration_file in configuration_files]
+        self.checkConfigurations()
+
+        self.doTranslations()
+    def checkCommandLineInput(self): # Looks for the required input files (one or more JSON configuration files)
+        if len(sys.argv)<2:
+            raise ValueError("There must be at least one input - the config files")
+        for argument in sys.argv[1:]:
+            if not os.path.isfile(str(argument)):
+                raise ValueError("Input file not found: "+str(argument))
+    def checkConfigurations(self): # Checks the configurations can be translated together
+        for compilation in self.compilations:
+            if compilation.shouldWatch():
+                raise ValueError("watch_interval can't be used when translating several configuration files ("+compilation.configuration_file+")")
+    def importMap(self,filepath): # Opens and imports a JSON map, unless another configuration has already loaded it
+        path = os.path.abspath(filepath)
+        if path not in self.maps:
+            file = open(filepath,"r")
+            self.maps[path] = json.load(file)
+            file.close()
+        return self.maps[path]
+
+    def getNumberOfWorkers(self): # Returns the number of worker processes needed by the configuration which uses the most
+        return max(compilation.getNumberOfWorkers() for compilation in self.compilations)
+    def dependsOn(self,compilation,earlier_compilation): # Checks whether a configuration has to wait for an earlier one (because they write to the same place, or either measures the memory it allocates, which can't be separated while both run)
+        if compilation.shouldProfileMemory() or earlier_compilation.shouldProfileMemory():
+            return True
+        return not compilation.getOutputPaths().isdisjoint(earlier_compilation.getOutputPaths())
+    def doTranslations(self): # Translates each configuration in its own thread, once the earlier configurations it depends on have finished
+        number_of_workers = self.getNumberOfWorkers()
+        if number_of_workers>1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=number_of_workers,mp_context=multiprocessing.get_context("spawn")) # Workers are started on demand while other threads are running, which isn't safe with fork
+        self.errors = [None]*len(self.compilations)
+        threads = []
+        try:
+            for index,compilation in enumerate(self.compilations):
+                dependencies = [thread for thread,earlier_compilation in zip(threads,self.compilations) if self.dependsOn(compilation,earlier_compilation)]
+                threads.append(threading.Thread(target=self.doTranslation,args=(index,dependencies)))
+                threads[-1].start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+        for error in self.errors: # Every configuration is attempted, then the first error is raised
+            if error is not None:
+                raise error
+    def doTranslation(self,index,dependencies): # Waits for the configurations this one depends on, then translates it (keeping any error to raise at the end)
+        for thread in dependencies:
+            thread.join()
+        compilation = self.compilations[index]
+        try:
+            compilation.doTranslation()
+            print("Finished "+compilation.configuration_file)
+        except Exception as error:
+            print("Could not translate {}: {}".format(compilation.configuration_file,error))
+            self.errors[index] = error
+class Dataset(): # Class to contain multiple datapoints (stored as columns)
+    def __init__(self,filename,configuration,column_header_map=None,proxy_name_map=None,workbook=None,column_numbers=None,file_contents=None):
         self.filename = filename
         self.configuration = configuration
         self.column_header_map = column_header_map
         self.proxy_name_map = proxy_name_map
+        self.integer_columns = set(self.correctColumnName(each_property["name"]) for each_property in self.configuration["properties"] if "integer" in each_property.keys() and each_property["integer"]) # Whole numbers in these columns are output without a decimal point
 
         self.filepath = self.configuration["root_folder"]+self.filename
 
-        self.datapoints = []
+        self.data_by_column = {}
+        self.number_of_datapoints = 0
 
+        self._excel_workbook = workbook # Opened in openFirstSheet, unless it has already been opened elsewhere
+        self.column_numbers = column_numbers # Zero indexed column for each property name (found from the header rows if not given)
+        self._file_contents = file_contents # The bytes of the file, if they have already been read (otherwise the file is read when it is opened)
         self._sheet = []
         self._header_rows = self.configuration["header_rows"]
 
+        memory_profile = "memory_profile" in self.configuration.keys() and self.configuration["memory_profile"]
+        if ("metrics_file" in self.configuration.keys() and self.configuration["metrics_file"]) or memory_profile:
+            self.metrics = StageMetrics(memory_profile=memory_profile)
+        else:
+            self.metrics = None
+
     def addDatapoints(self):
-        self.openFirstSheet()
-        self.collectColumns()
-        self.replaceNA()
-        self.parseToDatapoints()
+        self.runStage(self.openFirstSheet)
+        self.runStage(self.collectColumns)
+        self.runStage(self.replaceNA)
+        self.runStage(self.coerceNumericColumns)
+        self.runStage(self.applyPrecision)
+        self.runStage(self.parseToDatapoints)
+    def runStage(self,method): # Runs a method, recording its timing if metrics are being collected
+        if self.metrics is None:
+            return method()
+        return self.metrics.run(self.filename,method.__name__,method,rows=self.getNumberOfRows)
+    def getNumberOfRows(self): # Returns the number of rows below the header rows (read so far)
+        if "proxy" in self.data_by_column:
+            return len(self.data_by_column["proxy"])
+        if self._sheet:
+            return max(self._sheet.nrows-self._header_rows,0)
+        return 0
 
+    def shouldProjectRead(self): # Checks whether only the first sheet and the configured columns should be read
+        return "projected_read" in self.configuration.keys() and self.configuration["projected_read"]
     def openFirstSheet(self):
-        self._excel_workbook = xlrd.open_workbook(self.filepath)
+        if self._excel_workbook is None: # The workbook may already be open (when it has been verified first)
+            if self.shouldProjectRead():
+                on_demand = not self.filepath.endswith("xlsx") # Loading sheets on demand is only supported by xlrd for .xls files
+                self._excel_workbook = openWorkbook(self.filepath,file_contents=self._file_contents,on_demand=on_demand,ragged_rows=True) # Only the first sheet is loaded, and rows aren't padded out to the widest row
+            else:
+                self._excel_workbook = openWorkbook(self.filepath,file_contents=self._file_contents)
+            self._file_contents = None # No longer needed once the workbook is open
         self._sheet = self._excel_workbook.sheet_by_index(0)
+    def releaseWorkbook(self): # Frees the memory used by the workbook and drops references to it (so the dataset can be passed between processes)
+        self._excel_workbook.release_resources()
+        self._excel_workbook = None
+        self._sheet = None
     def collectColumns(self): # Create a variable which has the requesite columns as determined by the configuration file
-        output_dictionary = {}
+        column_names = []
+        column_numbers = []
         for column in self.configuration["properties"]:
-            column_name = self.correctColumnName(column["name"])
-            column_index = self.getUnknownColumnIndex(column["name"],column["column"])
-            if column_index:
-                output_dictionary[column_name] = self._sheet.col_values(self.charactersToOrd(column_index))[self._header_rows:]
-        self.data_by_column = output_dictionary
-    def replaceNA(self): # Replaces NA in the spreadsheets with None
-        for datapoint_index in range(len(self.data_by_column["proxy"])):
-            for column in self.data_by_column:
-                if self.data_by_column[column][datapoint_index]=="NA":
-                    self.data_by_column[column][datapoint_index] = None # Replace NA with None
-    def parseToDatapoints(self): # Convert the column dictionary into a list of Datapoints
-        for datapoint_index in range(len(self.data_by_column["proxy"])):
-            self.datapoints += [Datapoint()]
-            for column in self.data_by_column:
-                self.datapoints[-1].__dict__[column] = self.data_by_column[column][datapoint_index]
+            column_number = self.getColumnNumber(column["name"],column["column"])
+            if column_number is not None:
+                column_names.append(self.correctColumnName(column["name"]))
+                column_numbers.append(column_number)
+        if hasattr(self._sheet,"columns_values"): # Delimited text is parsed row by row, so every column is read in a single pass
+            self.data_by_column = dict(zip(column_names,self._sheet.columns_values(column_numbers,self._header_rows)))
+        else:
+            self.data_by_column = dict(zip(column_names,[self.getColumnValues(column_number) for column_number in column_numbers]))
+    def getColumnNumber(self,name,column): # Returns the zero indexed column for a property, or None if it can't be found
+        if self.column_numbers is None:
+            property_columns = self.getPropertyColumns()
+            self.column_numbers = dict(zip([name for name,column in property_columns],header_layout.resolveColumnNumbers(self.getHeaderRow(),property_columns)))
+        return self.column_numbers[name]
+    def getPropertyColumns(self): # Returns the name and configured column of each property (as a tuple, so it can be used as part of a cache key)
+        return tuple((each_property["name"],each_property["column"]) for each_property in self.configuration["properties"])
+    def getHeaderRow(self): # Returns the last header row (which identifies the layout of the sheet), or an empty tuple if there are no unknown columns to find
+        if "?" not in (column for name,column in self.getPropertyColumns()):
+            return ()
+        try:
+            return tuple(self._sheet.row_values(self._header_rows-1))
+        except IndexError:
+            #print("The number of header rows needs to be fixed before this file will be imported properly")
+            return ()
+    def getColumnValues(self,column_number): # Returns the values in a column below the header rows
+        if self.shouldProjectRead(): # Rows may be ragged, so cells beyond the end of a row are treated as empty
+            values = []
+            for row_number in range(self._header_rows,self._sheet.nrows):
+                if column_number<self._sheet.row_len(row_number):
+                    values.append(self._sheet.cell_value(row_number,column_number))
+                else:
+                    values.append("")
+            return values
+        return self._sheet.col_values(column_number)[self._header_rows:]
+    def addCachedDatapoints(self,data_by_column): # Uses columns saved from a previous run instead of reading the file
+        self.data_by_column = data_by_column
+        self.parseToDatapoints()
+
+    def getMissingValue(self): # Returns the value used to represent missing data (NA unless specified in the configuration file)
+        if "missing_value" in self.configuration.keys() and self.configuration["missing_value"]:
+            return self.configuration["missing_value"]
+        return "NA"
+    def replaceNA(self): # Converts each column to an array and replaces the missing value with None
+        missing_value = self.getMissingValue()
+        for column_name,values in self.data_by_column.items():
+            column = numpy.array(values,dtype=object)
+            column[column==missing_value] = None
+            self.data_by_column[column_name] = column
+    def coerceNumericColumns(self): # Converts numeric columns to arrays of floats (NaN where the value is missing), as long as every value that will be output is a number
+        has_proxy = self.data_by_column["proxy"].astype(bool) # Rows without a proxy aren't output, so their values don't matter
+        for each_property in self.configuration["properties"]:
+            column_name = self.correctColumnName(each_property["name"])
+            if "type" in each_property.keys() and each_property["type"]=="numeric" and column_name in self.data_by_column:
+                column = self.data_by_column[column_name]
+                is_number = numpy.fromiter((isinstance(value,float) for value in column),dtype=bool,count=len(column)) # xlrd gives all numbers as floats
+                is_missing = numpy.equal(column,None)
+                if numpy.all(is_number | is_missing | ~has_proxy):
+                    numeric_column = numpy.full(len(column),numpy.nan)
+                    numeric_column[is_number] = column[is_number].astype(float)
+                    self.data_by_column[column_name] = numeric_column
+    def applyPrecision(self): # Rounds whole numeric columns to the significant digits given in the configuration file, so there are fewer digits to encode
+        for each_property in self.configuration["properties"]:
+            column_name = self.correctColumnName(each_property["name"])
+            if "significant_digits" in each_property.keys() and each_property["significant_digits"] and column_name in self.data_by_column:
+                if self.data_by_column[column_name].dtype!=object: # Only columns which were converted to numbers
+                    self.data_by_column[column_name] = roundToSignificantDigits(self.data_by_column[column_name],each_property["significant_digits"])
+    def parseToDatapoints(self): # Keeps the column dictionary as the store of datapoints (rows are only created when they are needed)
+        self.number_of_datapoints = len(self.data_by_column["proxy"])
+    def getDatapoint(self,index): # Returns a Datapoint holding the values of a single row
+        datapoint_class = getDatapointClass(tuple(self.data_by_column.keys()))
+        return datapoint_class(*[self.getColumnAsList(column_name,[index])[0] for column_name in self.data_by_column])
+    def iterateDatapoints(self): # Yields a Datapoint for each row in turn (each column is converted to python values once, rather than once per row)
+        datapoint_class = getDatapointClass(tuple(self.data_by_column.keys()))
+        for values in zip(*[self.getColumnAsList(column_name) for column_name in self.data_by_column]):
+            yield datapoint_class(*values)
+    def __iter__(self):
+        return self.iterateDatapoints()
+    def __len__(self):
+        return self.number_of_datapoints
+    def getOutputRows(self): # Returns the indices of the rows that are output (those with a proxy)
+        return numpy.flatnonzero(self.data_by_column["proxy"].astype(bool))
+    def getOutputColumn(self,column_name,rows): # Returns the output values of a column for the chosen rows (with proxy names translated)
+        values = self.getColumnAsList(column_name,rows)
+        if column_name=="proxy":
+            proxy_names = {value:self.correctProxyName(value) for value in set(values)} # Each distinct proxy is only looked up once
+            values = [proxy_names[value] for value in values]
+        return values
+    def getOutputCodes(self,column_name,rows,table): # Returns the output values of a column as integer codes (-1 where missing), adding any new values to the table
+        values = self.getColumnAsList(column_name,rows)
+        codes_by_value = {None:-1}
+        for value in dict.fromkeys(values): # Each distinct value in order of appearance (so the codes don't change between runs)
+            if value not in codes_by_value:
+                output_value = self.correctProxyName(value) if column_name=="proxy" else value
+                codes_by_value[value] = table.setdefault(output_value,len(table))
+        return numpy.array([codes_by_value[value] for value in values],dtype="<i4")
+    def getNumericColumn(self,column_name,rows=None): # Returns a column as an array of floats, with NaN where the value is missing or isn't a number
+        column = self.data_by_column[column_name]
+        if rows is not None:
+            column = column[rows]
+        if column.dtype==object:
+            column = numpy.array([value if isinstance(value,float) else numpy.nan for value in column],dtype=float)
+        return column
+    def getNumericColumns(self,column_names,rows): # Returns the chosen rows of several columns as a two dimensional array of floats (NaN for columns the dataset doesn't have)
+        return numpy.column_stack([self.getNumericColumn(column_name,rows) if column_name in self.data_by_column else numpy.full(len(rows),numpy.nan) for column_name in column_names]+[numpy.empty((len(rows),0))])
+    def getColumnAsList(self,column_name,rows=None): # Returns a column (or the chosen rows of it) as a list of python values, with None where numeric values are missing
+        column = self.data_by_column[column_name]
+        if rows is not None:
+            column = column[rows]
+        values = column.tolist()
+        if column.dtype!=object:
+            for index in numpy.flatnonzero(numpy.isnan(column)):
+                values[index] = None
+            if column_name in self.integer_columns:
+                for index in numpy.flatnonzero(numpy.isfinite(column) & (column==numpy.trunc(column))):
+                    values[index] = int(values[index])
+        return values
     def correctColumnName(self,name): # Uses a column header map, if one is available, to translate header row names
         if self.column_header_map and name in self.column_header_map:
             return self.column_header_map[name]
@@ -118,30 +1178,15 @@ class Dataset(): # Class to contain multiple datapoints
         if self.proxy_name_map and name in self.proxy_name_map:
             return self.proxy_name_map[name]
         return name
-    def getUnknownColumnIndex(self,name,column): # Searches through the header rows to fill in unknown column indices
-        if column=="?":
-            try:
-                for column_number in range(self._sheet.ncols):
-                    value = self._sheet.cell_value(self._header_rows-1,column_number)
-                    if value==name:
-                        return self.ordToCharacters(column_number)
-            except:
-                pass
-                #print("The number of header rows needs to be fixed before this file will be imported properly")
-            #print("Column '"+name+"' not found")
-            return None
-        return column
 
     # Output
-    def convertDatapointsToFlatDictionaries(self): # Returns a list of dictionaries to represent each datapoint
-        datapoint_dictionary_list = []
-        for currentPoint in self.datapoints:
-            if currentPoint.proxy:
-                currentPoint.proxy = self.correctProxyName(currentPoint.proxy)
-                datapoint_dictionary_list.append({**currentPoint.convertToDictionary()})
-        return datapoint_dictionary_list
-    def toJSON(self): # Saves the file using the encoding and sorting
-        return json.dumps(self, default=lambda o: o.__dict__,sort_keys=True, indent=4)
+    def convertDatapointsToFlatDictionaries(self): # Returns a list of dictionaries to represent each datapoint (rows without a proxy are skipped)
+        rows = self.getOutputRows()
+        columns = {column_name:self.getOutputColumn(column_name,rows) for column_name in self.data_by_column}
+        column_names = tuple(columns.keys())
+        return [dict(zip(column_names,row)) for row in zip(*columns.values())]
+    def toJSON(self): # Returns every row (including those without a proxy) as JSON, with the columns sorted by name
+        return json.dumps([datapoint.convertToDictionary() for datapoint in self],sort_keys=True, indent=4)
 
     # static methods
     @staticmethod
@@ -159,16 +1204,89 @@ class Dataset(): # Class to contain multiple datapoints
             output[-2] = output[-2]%26
         output_str = "".join([chr(out+65) for out in output])[::-1]
         return output_str
-class Datapoint(): # Class to represent each datapoint
-    def __init__(self): # No need to create any content as it is done dynamically based on the configuation file
-        pass
+def ingestDataset(dataset): # Runs the methods for data collection on a dataset (defined at module level so it can be run in a worker process)
+    dataset.addDatapoints()
+    dataset.runStage(dataset.releaseWorkbook)
+    return dataset
+
+def roundToSignificantDigits(values,significant_digits): # Rounds an array of floats to a number of significant digits (NaN, infinity and zero are unchanged)
+    rounded = values.copy()
+    is_rounded = numpy.isfinite(values) & (values!=0)
+    values_to_round = values[is_rounded]
+    exponents = significant_digits-1-numpy.floor(numpy.log10(numpy.abs(values_to_round))).astype(int)
+    is_exact = numpy.abs(exponents)<=22 # Powers of ten up to 1e22 are exact floats, so the rounded values have their shortest decimal representation
+    scales = 10.0**numpy.abs(numpy.where(is_exact,exponents,0)) # Only calculated where exact (larger powers can overflow)
+    is_fractional = is_exact & (exponents>=0) # Rounded to a number of decimal places, rather than to tens, hundreds...
+    is_whole = is_exact & (exponents<0)
+    values_to_round[is_fractional] = numpy.round(values_to_round[is_fractional]*scales[is_fractional])/scales[is_fractional]
+    values_to_round[is_whole] = numpy.round(values_to_round[is_whole]/scales[is_whole])*scales[is_whole]
+    for index in numpy.flatnonzero(~is_exact): # Very large or small values are rounded through their decimal representation instead
+        values_to_round[index] = float("{:.{}e}".format(values_to_round[index],significant_digits-1))
+    is_overflowed = ~numpy.isfinite(values_to_round) # Values near the largest float can round up beyond it, so they are kept as they were
+    values_to_round[is_overflowed] = values[is_rounded][is_overflowed]
+    rounded[is_rounded] = values_to_round
+    return rounded
+
+def decimateLargestTriangleThreeBuckets(x,y,number_of_points): # Returns the indices of the points chosen by the Largest-Triangle-Three-Buckets algorithm (x must be sorted)
+    length = len(x)
+    number_of_points = max(number_of_points,3) # The first and last points, plus at least one bucket
+    if number_of_points>=length:
+        return numpy.arange(length)
+    bucket_size = (length-2)/(number_of_points-2) # The first and last points are always kept, the rest are split into buckets
+    selected = [0]
+    previous = 0
+    for bucket in range(number_of_points-2):
+        start = int(bucket*bucket_size)+1
+        end = int((bucket+1)*bucket_size)+1
+        next_end = min(int((bucket+2)*bucket_size)+1,length)
+        if end>=next_end: # The last bucket is compared against the last point
+            average_x,average_y = x[-1],y[-1]
+        else:
+            average_x,average_y = x[end:next_end].mean(),y[end:next_end].mean()
+        areas = numpy.abs((x[previous]-average_x)*(y[start:end]-y[previous])-(x[previous]-x[start:end])*(average_y-y[previous])) # Twice the area of the triangle formed with the previous point and the next bucket's average
+        previous = start+int(numpy.argmax(areas))
+        selected.append(previous)
+    selected.append(length-1)
+    return numpy.array(selected)
+def selectLevelOfDetailPoints(values,number_of_points): # Decimates rows of (age,co2,uncertainties...) sorted by age, always keeping the extreme CO2 values and uncertainty bounds
+    if len(values)<=number_of_points:
+        return numpy.arange(len(values))
+    selected = set(decimateLargestTriangleThreeBuckets(values[:,0],values[:,1],number_of_points).tolist())
+    co2 = values[:,1]
+    for bound in (co2,co2+values[:,4],co2-values[:,5]): # CO2, then its upper and lower uncertainty bounds
+        if not numpy.all(numpy.isnan(bound)):
+            selected.add(int(numpy.nanargmax(bound)))
+            selected.add(int(numpy.nanargmin(bound)))
+    return numpy.array(sorted(selected))
+
+class Datapoint(): # Base class to represent each datapoint, subclasses are created with a slot for each column (see getDatapointClass)
+    __slots__ = ()
+    _column_names = ()
+    _slot_by_column = {}
+
+    def __init__(self,*values):
+        for slot,value in zip(self.__slots__,values):
+            setattr(self,slot,value)
+    def __getattr__(self,name): # Only called for names which aren't slots, so values can still be looked up by column name
+        if name in self._slot_by_column:
+            return getattr(self,self._slot_by_column[name])
+        raise AttributeError(name)
     def __repr__(self): # Print each of the properties and their value to display
         output_string = ""
-        for the_property in self.__dict__.keys():
-            output_string += the_property+" = "+str(self.__dict__[the_property])+"\n"
+        for the_property,value in self.convertToDictionary().items():
+            output_string += the_property+" = "+str(value)+"\n"
         return output_string
 
-    def convertToDictionary(self): # Return the dictionary property when requested
-        return self.__dict__
+    def convertToDictionary(self): # Return the values as a dictionary keyed by column name
+        return {column_name:getattr(self,slot) for column_name,slot in zip(self._column_names,self.__slots__)}
+
+@functools.lru_cache(maxsize=None)
+def getDatapointClass(column_names): # Creates (once for each set of columns) a Datapoint class with a slot for each column
+    slots = tuple("_"+str(index) for index in range(len(column_names))) # Slots must be unique identifiers, which column names needn't be (e.g. "a b" and "a_b", or names starting with a digit)
+    return type("Datapoint",(Datapoint,),{"__slots__":slots,"_column_names":column_names,"_slot_by_column":dict(zip(column_names,slots))})
 
-compilation = Compilation()
+if __name__=="__main__": # Only run when called as a script (worker processes import this file)
+    if len(sys.argv)>2: # Several configuration files are translated together in one process
+        batch = Batch()
+    else:
+        compilation = Compilation()
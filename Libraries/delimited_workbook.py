@@ -0,0 +1,135 @@
+import os
+import io
+import re
+import csv
+import mmap
+import math
+import array
+import xlrd # Dependency (can be installed through pip)
+
+delimiters = {"csv":",","tsv":"\t"} # Delimiter for each file ending
+lone_carriage_return_pattern = re.compile(rb"\r(?!\n)")
+line_end_pattern = re.compile(rb"\r\n?|\n") # Lines may end with \r\n, \n or \r (as read by python's universal newlines)
+number_pattern = re.compile(r"\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*") # Cells which look like this are given as floats (as xlrd gives numbers)
+
+def isDelimited(filepath): # Checks whether a file is delimited text (rather than a workbook) from its file ending
+    return filepath.lower().endswith(tuple(delimiters.keys()))
+def openWorkbook(filepath,file_contents=None,**keywords): # Opens delimited text as a DelimitedWorkbook, and anything else with xlrd (which is given the keywords), from the file contents if they have already been read
+    if isDelimited(filepath):
+        return DelimitedWorkbook(filepath,file_contents=file_contents)
+    return xlrd.open_workbook(filepath,file_contents=file_contents,**keywords)
+
+class DelimitedWorkbook(): # Reads a .csv or .tsv file through a memory map, and presents it as a workbook with a single sheet
+    def __init__(self,filepath,encoding="utf-8-sig",file_contents=None):
+        self.filepath = filepath
+        self.delimiter = delimiters[filepath.lower().rsplit(".",1)[-1]]
+        self._file = None
+        self._map = None
+        self._sheets = [DelimitedSheet(self.openContents(file_contents),self.delimiter,encoding)]
+        self.nsheets = 1
+
+    def openContents(self,file_contents=None): # Returns the contents of the file (or the contents already read), memory mapped so that rows are only decoded when they are used
+        if file_contents is not None:
+            return file_contents
+        self._file = open(self.filepath,"rb")
+        if os.fstat(self._file.fileno()).st_size==0: # Empty files can't be memory mapped
+            return b""
+        self._map = mmap.mmap(self._file.fileno(),0,access=mmap.ACCESS_READ)
+        return self._map
+
+    def sheet_by_index(self,index): # Named to match xlrd
+        return self._sheets[index]
+    def release_resources(self): # Named to match xlrd
+        self._sheets = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class DelimitedSheet(): # Provides the parts of an xlrd sheet used by the scripts, with empty rows at the end removed and short rows padded with empty cells
+    rows_per_block = 10000 # Rows are decoded this many at a time when reading whole columns
+
+    def __init__(self,contents,delimiter,encoding):
+        self._contents = contents
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self._columns = {} # Columns read so far, for reading single cells (only the columns which are used are kept, rather than every cell of the file)
+        self.findRows()
+
+    def findRows(self): # Records where each row starts and how many cells it has (without keeping the cells), then removes empty rows at the end
+        self._offsets = array.array("q",[0]) # The start of each row in the contents, and the end of the last
+        self._lengths = array.array("l")
+        self.nrows = 0
+        if self._contents.find(b'"')==-1 and lone_carriage_return_pattern.search(self._contents) is None: # Without quotes (or lines ending in \r alone), each line is a row
+            self.findLines()
+        else:
+            for row in csv.reader(self.iterateLines(),delimiter=self.delimiter): # The reader takes one line at a time, so the end of each row is the position reached when it is returned
+                self.addRow(self._position,len(row),any(row))
+        self.ncols = max(self._lengths[:self.nrows],default=0) # Including rows of empty cells, but not the empty rows at the end
+    def findLines(self): # Finds the rows of a file where each line is a row, without decoding it (the number of cells is one more than the number of delimiters)
+        delimiter = self.delimiter.encode("ascii") # Encoding with utf-8-sig would add a byte order mark
+        position = 0
+        while position<len(self._contents):
+            end = self._contents.find(b"\n",position)
+            end = len(self._contents) if end==-1 else end+1
+            line = self._contents[position:end].rstrip(b"\r\n")
+            if position==0:
+                line = line.lstrip(b"\xef\xbb\xbf") # Byte order mark
+            self.addRow(end,line.count(delimiter)+1 if line else 0,bool(line.strip(delimiter)))
+            position = end
+    def addRow(self,end,length,has_values): # Records the end of a row and its number of cells (empty rows at the end aren't counted)
+        self._offsets.append(end)
+        self._lengths.append(length)
+        if has_values:
+            self.nrows = len(self._lengths)
+    def iterateLines(self): # Yields each line of the contents in turn, keeping the position of the end of the line
+        self._position = 0
+        while self._position<len(self._contents):
+            line_end = line_end_pattern.search(self._contents,self._position)
+            end = len(self._contents) if line_end is None else line_end.end()
+            line = self._contents[self._position:end]
+            self._position = end
+            yield str(line,self.encoding)
+    def iterateRows(self,start_rowx=0): # Yields the cells of each row from start_rowx onwards, decoding a block of rows at a time
+        for block_start in range(start_rowx,self.nrows,self.rows_per_block):
+            block_end = min(block_start+self.rows_per_block,self.nrows)
+            text = str(self._contents[self._offsets[block_start]:self._offsets[block_end]],self.encoding)
+            yield from csv.reader(io.StringIO(text,newline=""),delimiter=self.delimiter)
+
+    @staticmethod
+    def convertValue(text): # Gives numbers as floats and anything else (including numbers too large for a float) as text
+        if number_pattern.fullmatch(text):
+            value = float(text)
+            if math.isfinite(value):
+                return value
+        return text
+
+    def row_len(self,row_number):
+        if row_number>=self.nrows:
+            raise IndexError("list index out of range")
+        return self._lengths[row_number]
+    def cell_value(self,row_number,column_number):
+        if row_number>=self.nrows or column_number>=self.ncols:
+            raise IndexError("list index out of range")
+        if column_number not in self._columns:
+            self._columns[column_number] = self.col_values(column_number)
+        return self._columns[column_number][row_number]
+    def row_values(self,row_number):
+        if row_number>=self.nrows:
+            raise IndexError("list index out of range")
+        text = str(self._contents[self._offsets[row_number]:self._offsets[row_number+1]],self.encoding)
+        row = next(csv.reader(io.StringIO(text,newline=""),delimiter=self.delimiter),[])
+        return [self.convertValue(value) for value in row]+[""]*(self.ncols-len(row))
+    def col_values(self,column_number,start_rowx=0):
+        return self.columns_values([column_number],start_rowx)[0]
+    def columns_values(self,column_numbers,start_rowx=0): # Not part of xlrd, reads several columns in one pass through the rows
+        for column_number in column_numbers:
+            if column_number>=self.ncols:
+                raise IndexError("list index out of range")
+        columns = [[] for column_number in column_numbers]
+        for row in self.iterateRows(start_rowx):
+            for column,column_number in zip(columns,column_numbers):
+                column.append(self.convertValue(row[column_number]) if column_number<len(row) else "")
+        return columns
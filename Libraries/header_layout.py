@@ -0,0 +1,23 @@
+import functools
+
+def charactersToOrd(characters): # Translates alphabetic column letters into a zero indexed column number (None if there are no letters)
+    if characters is None:
+        return None
+    order = 0
+    for index,character in enumerate(characters):
+        reversed_index = len(characters)-index-1
+        order += (26**reversed_index)*(ord(character)-65)
+    return order
+
+@functools.lru_cache(maxsize=None)
+def resolveColumnNumbers(header_row,property_columns): # Returns the zero indexed column of each (name,column) property in turn, or None where an unknown (?) column can't be found in the header row (worked out once for each header layout)
+    header_index = {}
+    for column_number,value in enumerate(header_row):
+        header_index.setdefault(value,column_number) # Where a name is repeated, the first column is used
+    column_numbers = []
+    for name,column in property_columns:
+        if column=="?":
+            column_numbers.append(header_index.get(name))
+        else:
+            column_numbers.append(charactersToOrd(column))
+    return tuple(column_numbers)
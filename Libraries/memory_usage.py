@@ -0,0 +1,68 @@
+import sys
+import tracemalloc
+try:
+    import resource # Not available on Windows, where peak memory isn't reported
+except ImportError:
+    resource = None
+
+def getPeakRSS(include_children=False): # Returns the peak resident set size of this process in MB (or of its largest finished child process, if that is larger), or None if it can't be measured
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak,resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform=="darwin": # macOS reports bytes rather than kilobytes
+        return peak/(1024*1024)
+    return peak/1024
+def checkMemoryBudget(budget,include_children=False): # Raises a MemoryError if the peak resident set size (in MB) is over the budget
+    peak = getPeakRSS(include_children)
+    if peak is None:
+        print("Peak memory can't be measured on this platform, so the memory budget wasn't checked")
+    elif peak>budget:
+        raise MemoryError("Peak memory of {:.1f} MB exceeded the budget of {} MB".format(peak,budget))
+
+class AllocationTracker(): # Measures the memory allocated while something runs, and the lines of code which allocated most of it, using tracemalloc
+    def __init__(self,number_of_sites=5,minimum_bytes=1024):
+        self.number_of_sites = number_of_sites
+        self.minimum_bytes = minimum_bytes # Smaller sites are left out (e.g. the bookkeeping of whatever is recording the measurements)
+        self._snapshot = None
+
+    def start(self): # Call before the code to measure
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._snapshot = self.takeSnapshot()
+        self._start_size = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc,"reset_peak"): # Python 3.9+
+            tracemalloc.reset_peak()
+    def stop(self): # Call after the code to measure, returns the memory still allocated, the peak while running (if available) and the largest allocation sites
+        size,peak = tracemalloc.get_traced_memory()
+        sites = []
+        for statistic in self.takeSnapshot().compare_to(self._snapshot,"lineno")[:self.number_of_sites]:
+            if statistic.size_diff>=self.minimum_bytes:
+                sites.append({"site":str(statistic.traceback[0]),"bytes":statistic.size_diff})
+        self._snapshot = None # Snapshots are large, and can't be passed between processes
+        return {"allocated_bytes":size-self._start_size,
+                "peak_bytes":peak-self._start_size if hasattr(tracemalloc,"reset_peak") else None,
+                "allocation_sites":sites}
+    @staticmethod
+    def takeSnapshot(): # Takes a snapshot of the allocations, ignoring those made by tracemalloc and this tracker
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False,tracemalloc.__file__),tracemalloc.Filter(False,__file__)])
+
+def combineAllocationSites(records,number_of_sites=5): # Adds up the allocation sites of records (each with a stage), returning the largest sites of each stage
+    bytes_by_stage = {}
+    for record in records:
+        if "allocation_sites" in record.keys():
+            bytes_by_site = bytes_by_stage.setdefault(record["stage"],{})
+            for site in record["allocation_sites"]:
+                bytes_by_site[site["site"]] = bytes_by_site.get(site["site"],0)+site["bytes"]
+    return {stage:[{"site":site,"bytes":size} for site,size in sorted(bytes_by_site.items(),key=lambda item:item[1],reverse=True)[:number_of_sites]] for stage,bytes_by_site in bytes_by_stage.items()}
+def printMemorySummary(records,include_children=False,number_of_sites=3): # Prints the peak resident set size, and the largest allocation sites of each stage
+    peak = getPeakRSS(include_children)
+    if peak is not None:
+        print("Peak memory: {:.1f} MB".format(peak))
+    for stage,sites in combineAllocationSites(records,number_of_sites).items():
+        if not sites:
+            continue
+        print("Largest allocations in "+stage+":")
+        for site in sites:
+            print("    {}: {:.2f} MB".format(site["site"],site["bytes"]/(1024*1024)))
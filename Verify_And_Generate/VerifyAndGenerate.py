@@ -0,0 +1,66 @@
+import sys
+import os
+
+sys.path.append('./../Verify_Spreadsheets') # Add the verifier folder to the path
+sys.path.append('./../Generate_JSON') # Add the JSON generation folder to the path (which also adds the library folder)
+from VerifyPaleoCO2Spreadsheets import Verifier
+from GenerateJSON import Compilation,ingestDataset
+from delimited_workbook import openWorkbook
+
+class Pipeline(): # Verifies each spreadsheet then converts it to JSON, opening each workbook only once
+    def __init__(self):
+        self.checkCommandLineInput()
+        self.verifier = Verifier(str(sys.argv[1]),analyse=False)
+        self.compilation = Compilation(str(sys.argv[1]),translate=False)
+
+        self.run()
+
+    # inputs
+    def checkCommandLineInput(self): # Looks for the required input file (the JSON configuration file)
+        if len(sys.argv)!=2:
+            raise ValueError("There must be one input - the config file")
+        if not os.path.isfile(str(sys.argv[1])):
+            raise ValueError("Input file not found")
+    def shouldExcludeFailedFiles(self): # Checks whether files which fail verification should be left out of the output (otherwise they are only flagged)
+        return "exclude_failed_files" in self.compilation.configuration.keys() and self.compilation.configuration["exclude_failed_files"]
+
+    # running
+    def getColumnNumbers(self): # Returns the column numbers found by the verifier, as long as it used the configured number of header rows
+        if self.verifier._current_header_rows!=self.compilation.configuration["header_rows"]:
+            return None
+        return {each_property["name"]:each_property["column_number"] for each_property in self.verifier.json_contents["properties"]}
+    def run(self): # Verifies each file, converts the ones to be output from the same workbook, then writes the outputs
+        files = [file for file in self.compilation.listFiles() if self.verifier.shouldBeAnalysed(file)]
+        datasets_by_file = {}
+        self.failed_files = []
+
+        self.verifier.startAnalysis()
+        for file in files:
+            workbook = openWorkbook(self.compilation.configuration["root_folder"]+file)
+            result = self.verifier.verifyFile(file,workbook)
+            if result=="FAIL":
+                self.failed_files.append(file)
+                if self.shouldExcludeFailedFiles():
+                    workbook.release_resources()
+                    continue
+            dataset = self.compilation.createDataset(file,workbook=workbook,column_numbers=self.getColumnNumbers())
+            datasets_by_file[file] = ingestDataset(dataset) # Also releases the workbook
+        self.verifier.printSummary()
+        self.printFailedFiles()
+
+        self.compilation.doTranslation(unchanged_datasets=datasets_by_file,files=[file for file in files if file in datasets_by_file])
+
+    # outputs
+    def printFailedFiles(self): # Lists the files which failed verification, and whether they were left out
+        if not self.failed_files:
+            return
+        print(" ")
+        if self.shouldExcludeFailedFiles():
+            print("Excluded "+str(len(self.failed_files))+" files which failed verification:")
+        else:
+            print("Included "+str(len(self.failed_files))+" files which failed verification (see the log file for details):")
+        for file in self.failed_files:
+            print("    "+file)
+
+if __name__=="__main__":
+    Pipeline()
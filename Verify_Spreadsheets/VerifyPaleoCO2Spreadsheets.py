@@ -1,15 +1,20 @@
 import sys
 import os
 import math
-import xlrd             # Needs install (available through pip)
 import requests         # Needs install (available through pip)
 
 sys.path.append('./../Libraries') # Add the library folder to the path
 import json_alternate as json  # Needs local folder
+from delimited_workbook import openWorkbook # Needs local folder (opens .csv and .tsv files as well as workbooks)
+import memory_usage # Needs local folder
+import header_layout # Needs local folder
 
 class Verifier:
-    def __init__(self):
-        self.checkCommandLineInput()
+    def __init__(self,configuration_file=None,analyse=True):
+        self.configuration_file = configuration_file
+        if self.configuration_file is None:
+            self.checkCommandLineInput()
+            self.configuration_file = str(sys.argv[1])
 
         self._json_contents = ""
         self.importJSON()
@@ -26,7 +31,11 @@ class Verifier:
         self.last_successful_doi = None
         self.last_successful_url_request = None
 
-        self.analyse()
+
+        self.setUpMemoryProfile()
+
+        if analyse:
+            self.analyse()
 
     # inputs
     def checkCommandLineInput(self): # Looks for the required input file (the JSON configuration file)
@@ -35,7 +44,7 @@ class Verifier:
         if not os.path.isfile(str(sys.argv[1])):
             raise ValueError("Input file not found")
     def importJSON(self): # Opens and imports the JSON configuration file
-        file = open(str(sys.argv[1]),"r")
+        file = open(self.configuration_file,"r")
         self.json_contents = json.load(file)
         file.close()
     def createOutputFile(self): # Creates the output log file with the name specified in the JSON configuration file
@@ -130,26 +139,21 @@ class Verifier:
     def correctRootFolder(self): # Adds a trailing slash to root folder if required
         if not self.json_contents["root_folder"].endswith("/"):
             self.json_contents["root_folder"] += "/"
-    def calculateColumnIndex(self): # Iterates over properties to convert the alphabetic column indices to zero indexed values
-        for each_property in self.json_contents["properties"]:
-            column_index = self.getUnknownColumnIndex(each_property["name"],each_property["column"])
-            if column_index is not None:
-                each_property["column_number"] = self.charactersToOrd(column_index)
-            else:
-                each_property["column_number"] = None
-
-    def getUnknownColumnIndex(self,name,column): # Searches through the header rows to fill in unknown column indices
-        if column=="?":
-            try:
-                for column_number in range(self.current_sheet.ncols):
-                    value = self.current_sheet.cell_value(self._current_header_rows-1,column_number)
-                    if value==name:
-                        return self.ordToCharacters(column_number)
-            except:
-                print("This should only happen if the file is shorter than the number of header rows")
-            self.writeOutput("1. Could not find header '_"+name+"_'")
-            return None
-        return column
+    def calculateColumnIndex(self): # Iterates over properties to convert the alphabetic column indices to zero indexed values (resolving each header layout only once)
+        property_columns = tuple((each_property["name"],each_property["column"]) for each_property in self.json_contents["properties"])
+        for each_property,column_number in zip(self.json_contents["properties"],header_layout.resolveColumnNumbers(self.getHeaderRow(),property_columns)):
+            each_property["column_number"] = column_number
+            if column_number is None:
+                self.writeOutput("1. Could not find header '_"+each_property["name"]+"_'")
+
+    def getHeaderRow(self): # Returns the last header row (which identifies the layout of the sheet), or an empty tuple if there are no unknown columns to find
+        if not any(each_property["column"]=="?" for each_property in self.json_contents["properties"]):
+            return ()
+        try:
+            return tuple(self.current_sheet.row_values(self._current_header_rows-1))
+        except (TypeError,IndexError):
+            print("This should only happen if the file is shorter than the number of header rows")
+            return ()
 
     def guessNumberOfHeaderRows(self): # Attempts to guess the number of header rows, first by looking for 'proxy', then by looking for anything non-empty
         try:
@@ -484,74 +488,107 @@ class Verifier:
 
     # collective method
     def analyse(self): # This is the collective method that applies each of the methods
+        self.startAnalysis()
+        for this_file in os.listdir(self.json_contents["root_folder"])[::]:
+            if self.shouldBeAnalysed(this_file):
+                workbook = self.runStage(this_file,"openWorkbook",openWorkbook,self.json_contents["root_folder"]+this_file)
+                self.runStage(this_file,"verifyFile",self.verifyFile,this_file,workbook)
+                workbook.release_resources()
+        self.printSummary()
+        self.printMemorySummary()
+    def setUpMemoryProfile(self): # Prepares to record the memory allocated by each stage, if a memory profile is requested in the configuration file
+        self.memory_records = []
+        if "memory_profile" in self.json_contents.keys() and self.json_contents["memory_profile"]:
+            self.allocation_tracker = memory_usage.AllocationTracker()
+        else:
+            self.allocation_tracker = None
+    def runStage(self,this_file,stage,function,*arguments): # Runs a function, recording the memory it allocates if a memory profile was requested
+        if self.allocation_tracker is None:
+            return function(*arguments)
+        self.allocation_tracker.start()
+        result = function(*arguments)
+        record = {"file":this_file,"stage":stage}
+        record.update(self.allocation_tracker.stop())
+        self.memory_records.append(record)
+        return result
+    def printMemorySummary(self): # Prints the peak memory and largest allocations (if a memory profile was requested), then checks the memory budget (if there is one)
+        if self.allocation_tracker is not None:
+            self.consoleOutput(" ")
+            memory_usage.printMemorySummary(self.memory_records)
+        if "memory_budget_mb" in self.json_contents.keys() and self.json_contents["memory_budget_mb"] is not None:
+            memory_usage.checkMemoryBudget(self.json_contents["memory_budget_mb"])
+    def startAnalysis(self): # Resets the totals before any files are verified
         print("Processing: ")
         self.total_so_far = 0
         self.total_fail = 0
         self.total_pass = 0
         self.total_warn = 0
-        color_flag = False
-        for this_file in os.listdir(self.json_contents["root_folder"])[::]:
-            if this_file.endswith(tuple(self.json_contents["file_endings"])) and not this_file.startswith("~"):
-                self.total_so_far += 1
-
-                self.setBackgroundColor()
-
-                self.consoleOutput(this_file,background_color=self._current_background_color,end="")
-
-                self._current_pass = True
-                self._current_warning = False
-                self._type_pass = False
-                self._DOI_property = None
-                self.current_workbook = xlrd.open_workbook(self.json_contents["root_folder"]+this_file)
-                self.current_sheet = self.current_workbook.sheet_by_index(0)
-
-                self.writeOutput("# "+this_file)
-
-                self._current_header_rows = self.guessNumberOfHeaderRows()
-                self.checkHeaderRows()
-                self.guessNumberOfDataRows()
-                self.calculateColumnIndex()
-
-                for each_property in self.json_contents["properties"]:
-                    self._current_property = each_property
-                    if self._current_property["column_number"] is not None:
-                        self.checkName()
-                        self.checkRequired()
-                        self.checkType()
-                        if self._type_pass:
-                            self.checkHardLimits()
-                            self.checkSoftLimits()
-                            self.checkAcceptableValues()
-                        else:
-                            self.writeOutput("Could not perform further checks because variable is of incorrect type")
-
-                for each_property in self.json_contents["properties"]:
-                    self._current_property = each_property
-                    if self._current_property["column_number"] is not None:
-                        self.checkDOI()
-                for each_property in self.json_contents["properties"]:
-                    self._current_property = each_property
-                    if self._current_property["column_number"] is not None:
-                        self.checkReference()
-
-                self.current_workbook.release_resources()
-                self.writeOutput("")
-
-                # Finish up
-                if self._current_pass is False:
-                    self.total_fail += 1
-                    self.consoleOutput(" "*(50-len(this_file)-len("FAIL")),background_color=self._current_background_color,end="")
-                    self.consoleOutput("FAIL",text_color=self.getTextColor("FAIL"),background_color=self._current_background_color)
-                elif self._current_warning is True:
-                    self.total_warn += 1
-                    self.consoleOutput(" "*(50-len(this_file)-len("WARN")),background_color=self._current_background_color,end="")
-                    self.consoleOutput("WARN",text_color=self.getTextColor("WARN"),background_color=self._current_background_color)
-                elif self._current_pass is True:
-                    self.total_pass += 1
-                    self.consoleOutput(" "*(50-len(this_file)-len("PASS")),background_color=self._current_background_color,end="")
-                    self.consoleOutput("PASS",text_color=self.getTextColor("PASS"),background_color=self._current_background_color)
+    def shouldBeAnalysed(self,this_file): # Checks the file has one of the file endings, and doesn't start with ~ (Windows temporary files)
+        return this_file.endswith(tuple(self.json_contents["file_endings"])) and not this_file.startswith("~")
+    def verifyFile(self,this_file,workbook): # Applies each of the checks to the first sheet of an open workbook, and returns "PASS", "WARN" or "FAIL"
+        self.total_so_far += 1
+
+        self.setBackgroundColor()
+
+        self.consoleOutput(this_file,background_color=self._current_background_color,end="")
+
+        self._current_pass = True
+        self._current_warning = False
+        self._type_pass = False
+        self._DOI_property = None
+        self.current_workbook = workbook
+        self.current_sheet = self.current_workbook.sheet_by_index(0)
+
+        self.writeOutput("# "+this_file)
+
+        self._current_header_rows = self.guessNumberOfHeaderRows()
+        self.checkHeaderRows()
+        self.guessNumberOfDataRows()
+        self.calculateColumnIndex()
+
+        for each_property in self.json_contents["properties"]:
+            self._current_property = each_property
+            if self._current_property["column_number"] is not None:
+                self.checkName()
+                self.checkRequired()
+                self.checkType()
+                if self._type_pass:
+                    self.checkHardLimits()
+                    self.checkSoftLimits()
+                    self.checkAcceptableValues()
                 else:
-                    print("Error")
+                    self.writeOutput("Could not perform further checks because variable is of incorrect type")
+
+        for each_property in self.json_contents["properties"]:
+            self._current_property = each_property
+            if self._current_property["column_number"] is not None:
+                self.checkDOI()
+        for each_property in self.json_contents["properties"]:
+            self._current_property = each_property
+            if self._current_property["column_number"] is not None:
+                self.checkReference()
+
+        self.writeOutput("")
+
+        # Finish up
+        if self._current_pass is False:
+            self.total_fail += 1
+            self.consoleOutput(" "*(50-len(this_file)-len("FAIL")),background_color=self._current_background_color,end="")
+            self.consoleOutput("FAIL",text_color=self.getTextColor("FAIL"),background_color=self._current_background_color)
+            return "FAIL"
+        elif self._current_warning is True:
+            self.total_warn += 1
+            self.consoleOutput(" "*(50-len(this_file)-len("WARN")),background_color=self._current_background_color,end="")
+            self.consoleOutput("WARN",text_color=self.getTextColor("WARN"),background_color=self._current_background_color)
+            return "WARN"
+        elif self._current_pass is True:
+            self.total_pass += 1
+            self.consoleOutput(" "*(50-len(this_file)-len("PASS")),background_color=self._current_background_color,end="")
+            self.consoleOutput("PASS",text_color=self.getTextColor("PASS"),background_color=self._current_background_color)
+            return "PASS"
+        else:
+            print("Error")
+    def printSummary(self): # Prints the percentage of files which passed, had warnings or failed
         self.consoleOutput(" ")
         self.consoleOutput("Summary")
         self.consoleOutput("__________________")
@@ -583,4 +620,5 @@ class Verifier:
             return None
 
 # Create the object and run the functions
-Verifier()
+if __name__=="__main__": # Only run when called as a script (not when imported by the combined pipeline)
+    Verifier()